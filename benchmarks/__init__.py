@@ -0,0 +1,12 @@
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Microbenchmarks of visdom, written for asv (see asv.conf.json at the root of
+the repository), and runnable without it from the root of the repository:
+
+    PYTHONPATH=py python -m benchmarks -bench Scatter -output results.json
+"""
@@ -0,0 +1,199 @@
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Runs the asv benchmarks of this directory without asv. For each `time_`
+benchmark and combination of its parameters, reports the best time per call
+and the peak memory allocated by one call (measured with tracemalloc).
+"""
+
+import argparse
+import importlib
+import inspect
+import itertools
+import json
+import os
+import pkgutil
+import platform
+import re
+import time
+import timeit
+import tracemalloc
+
+import visdom
+
+MIN_RUN_TIME = 0.2  # seconds per repeat
+REPEATS = 3
+
+
+def discover(pattern):
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for module_info in pkgutil.iter_modules([package_dir]):
+        if module_info.name.startswith("_"):
+            continue
+        module = importlib.import_module("benchmarks." + module_info.name)
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            for name in sorted(dir(cls)):
+                if not name.startswith("time_"):
+                    continue
+                bench_name = "{}.{}.{}".format(module_info.name, cls.__name__, name)
+                if pattern is None or re.search(pattern, bench_name):
+                    yield bench_name, cls, name
+
+
+def param_grid(cls):
+    params = getattr(cls, "params", [])
+    if params and not isinstance(params[0], list):
+        params = [params]
+    names = getattr(cls, "param_names", [])
+    names = names or ["param{}".format(i) for i in range(len(params))]
+    for values in itertools.product(*params):
+        yield dict(zip(names, values)), values
+
+
+def measure(func, quick):
+    if quick:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+    timer = timeit.Timer(func)
+    number, total = timer.autorange()
+    number = max(1, int(number * MIN_RUN_TIME / max(total, 1e-9)))
+    return min(timer.repeat(repeat=REPEATS, number=number)) / number
+
+
+def peak_allocation(func):
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(cls, method_name, values, quick):
+    bench = cls()
+
+    def setup():
+        if hasattr(bench, "setup"):
+            bench.setup(*values)
+
+    def teardown():
+        if hasattr(bench, "teardown"):
+            bench.teardown(*values)
+
+    try:
+        setup()
+    except NotImplementedError:
+        return None  # not available here, like asv
+    method = getattr(bench, method_name)
+
+    def func():
+        method(*values)
+
+    try:
+        if getattr(bench, "number", 0) == 1:
+            # each call changes the state, run the setup again before each one
+            times = []
+            for i in range(1 if quick else REPEATS):
+                if i > 0:
+                    teardown()
+                    setup()
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+            seconds = min(times)
+            teardown()
+            setup()
+        else:
+            seconds = measure(func, quick)
+        peak = peak_allocation(func)
+    finally:
+        teardown()
+    return seconds, peak
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.3g} {}".format(seconds / scale, unit)
+    return "{:.3g} ns".format(seconds / 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the visdom benchmarks.")
+    parser.add_argument(
+        "-bench",
+        metavar="bench",
+        type=str,
+        default=None,
+        help="regular expression selecting the benchmarks to run, "
+        'matched against "module.Class.time_method".',
+    )
+    parser.add_argument(
+        "-quick",
+        default=False,
+        action="store_true",
+        help="time a single call of each benchmark.",
+    )
+    parser.add_argument(
+        "-output",
+        metavar="output",
+        type=str,
+        default=None,
+        help="write the results as json to this file.",
+    )
+    FLAGS = parser.parse_args()
+
+    results = []
+    for bench_name, cls, method_name in discover(FLAGS.bench):
+        for params, values in param_grid(cls):
+            label = "{}({})".format(
+                bench_name, ", ".join("{}={}".format(k, v) for k, v in params.items())
+            )
+            try:
+                measured = run_benchmark(cls, method_name, values, FLAGS.quick)
+            except Exception as exc:
+                print("{:<70} failed: {!r}".format(label, exc), flush=True)
+                continue
+            if measured is None:
+                print("{:<70} skipped".format(label), flush=True)
+                continue
+            seconds, peak = measured
+            print(
+                "{:<70} {:>10} {:>10.2f} MB".format(
+                    label, format_time(seconds), peak / 1e6
+                ),
+                flush=True,
+            )
+            results.append(
+                {
+                    "name": bench_name,
+                    "params": params,
+                    "seconds": seconds,
+                    "peak_bytes": peak,
+                }
+            )
+
+    if FLAGS.output is not None:
+        with open(FLAGS.output, "w") as fn:
+            json.dump(
+                {
+                    "visdom_version": visdom.__version__,
+                    "python_version": platform.python_version(),
+                    "time": time.time(),
+                    "results": results,
+                },
+                fn,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Cost of building the messages of the python client, for the plot functions
+that do the most work on their inputs. The messages are built and json
+encoded as for a server, then dropped instead of being sent.
+"""
+
+import json
+
+import numpy as np
+
+import visdom
+from visdom.utils.shared_utils import get_rand_id
+
+POINTS = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+
+class PayloadClient(visdom.Visdom):
+    """Client building its messages like for a server, without sending them"""
+
+    def __init__(self):
+        super().__init__(send=False, use_incoming_socket=False)
+
+    def _send(self, msg, endpoint="events", quiet=False, from_log=False, create=True):
+        msg, endpoint = super()._send(msg, endpoint, quiet, from_log, create)
+        if "win" in msg and msg["win"] is None and create:
+            msg["win"] = "window_" + get_rand_id()
+        json.dumps(msg)
+        return msg.get("win", True)
+
+
+class ClientBenchmark:
+    timeout = 300
+
+    def setup(self, *params):
+        self.vis = PayloadClient()
+        self.rng = np.random.RandomState(0)
+
+
+class Scatter(ClientBenchmark):
+    params = [POINTS, [1, 10]]
+    param_names = ["points", "traces"]
+
+    def setup(self, points, traces):
+        super().setup()
+        self.X = self.rng.rand(points, 2)
+        self.Y = np.arange(points) % traces + 1
+
+    def time_scatter(self, points, traces):
+        self.vis.scatter(self.X, self.Y)
+
+    def peakmem_scatter(self, points, traces):
+        self.vis.scatter(self.X, self.Y)
+
+
+class Line(ClientBenchmark):
+    params = [POINTS, [1, 10]]
+    param_names = ["points", "traces"]
+
+    def setup(self, points, traces):
+        super().setup()
+        self.Y = self.rng.rand(points // traces, traces)
+        self.X = np.arange(points // traces)
+
+    def time_line(self, points, traces):
+        self.vis.line(self.Y, self.X)
+
+    def peakmem_line(self, points, traces):
+        self.vis.line(self.Y, self.X)
+
+
+class Heatmap(ClientBenchmark):
+    params = [[32, 100, 316, 1000, 3162]]
+    param_names = ["side"]
+
+    def setup(self, side):
+        super().setup()
+        self.X = self.rng.rand(side, side)
+
+    def time_heatmap(self, side):
+        self.vis.heatmap(self.X)
+
+    def peakmem_heatmap(self, side):
+        self.vis.heatmap(self.X)
+
+
+class Bar(ClientBenchmark):
+    params = [[10**3, 10**4, 10**5, 10**6], [1, 10]]
+    param_names = ["points", "stacks"]
+
+    def setup(self, points, stacks):
+        super().setup()
+        self.X = self.rng.rand(points // stacks, stacks)
+        if stacks == 1:
+            self.X = self.X[:, 0]
+
+    def time_bar(self, points, stacks):
+        self.vis.bar(self.X, opts={"stacked": True})
+
+    def peakmem_bar(self, points, stacks):
+        self.vis.bar(self.X, opts={"stacked": True})
+
+
+class Image(ClientBenchmark):
+    params = [[64, 256, 1024, 2048]]
+    param_names = ["size"]
+
+    def setup(self, size):
+        super().setup()
+        self.img = self.rng.rand(3, size, size)
+
+    def time_image(self, size):
+        self.vis.image(self.img)
+
+    def peakmem_image(self, size):
+        self.vis.image(self.img)
+
+
+class Images(ClientBenchmark):
+    params = [[8, 64], [32, 128, 256]]
+    param_names = ["batch", "size"]
+
+    def setup(self, batch, size):
+        super().setup()
+        self.tensor = self.rng.rand(batch, 3, size, size)
+
+    def time_images(self, batch, size):
+        self.vis.images(self.tensor)
+
+    def peakmem_images(self, batch, size):
+        self.vis.images(self.tensor)
+
+
+class Embeddings(ClientBenchmark):
+    params = [[100, 1000], [10, 50]]
+    param_names = ["points", "features"]
+
+    def setup(self, points, features):
+        super().setup()
+        self.features = self.rng.rand(points, features)
+        self.labels = [str(i % 10) for i in range(points)]
+        try:
+            self.vis.embeddings(self.features[:30], self.labels[:30])
+        except Exception:
+            raise NotImplementedError("no embeddings backend available")
+
+    def time_embeddings(self, points, features):
+        self.vis.embeddings(self.features, self.labels)
+
+    def peakmem_embeddings(self, points, features):
+        self.vis.embeddings(self.features, self.labels)
+
+
+class EmbeddingsLayout(ClientBenchmark):
+    """The layouts of the NumPy methods of embeddings, on clustered features"""
+
+    params = [[10**3, 10**4, 10**5], ["pca", "landmark"]]
+    param_names = ["points", "method"]
+
+    def setup(self, points, method):
+        super().setup()
+        centers = self.rng.randn(10, 128) * 5
+        labels = self.rng.randint(0, 10, points)
+        self.features = centers[labels] + self.rng.randn(points, 128)
+
+    def time_embeddings_layout(self, points, method):
+        visdom.compute_embeddings(self.features, method)
+
+    def peakmem_embeddings_layout(self, points, method):
+        visdom.compute_embeddings(self.features, method)
+
+
+class Graph(ClientBenchmark):
+    params = [[100, 1000, 10000]]
+    param_names = ["nodes"]
+
+    def setup(self, nodes):
+        import networkx  # noqa: F401, imported by the first call otherwise
+
+        super().setup()
+        # a path through all of the nodes, plus random edges
+        self.edges = [(i, i + 1) for i in range(nodes - 1)] + [
+            (int(a), int(b)) for a, b in self.rng.randint(0, nodes, size=(nodes, 2))
+        ]
+
+    def time_graph(self, nodes):
+        self.vis.graph(self.edges)
+
+    def peakmem_graph(self, nodes):
+        self.vis.graph(self.edges)
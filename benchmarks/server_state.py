@@ -0,0 +1,277 @@
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Cost of the operations of the server on its state, driven directly with fake
+handler and socket objects over synthetic envs of increasing size. The
+messages are the ones the python client sends.
+"""
+
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+import visdom
+from visdom.server.handlers.web_handlers import UpdateHandler
+from visdom.utils.server_utils import (
+    broadcast,
+    compare_envs,
+    load_env,
+    register_window,
+    serialize_env,
+    stringify,
+    update_window,
+    window,
+)
+
+EID = "bench"
+
+
+class FakeSocket:
+    """Stands in for the socket of a browser, encoding what it is sent"""
+
+    def __init__(self, eid=None):
+        self.eid = eid
+        self.subs = {}
+        self.num_messages = 0
+
+    def write_message(self, msg):
+        if isinstance(msg, dict):
+            msg = json.dumps(msg)  # as tornado does
+        self.num_messages += 1
+
+
+class FakeHandler:
+    """Stands in for a request handler, with the state of a server"""
+
+    def __init__(self, state=None, num_subs=0, eid=EID):
+        self.state = {} if state is None else state
+        self.subs = {str(i): FakeSocket(eid) for i in range(num_subs)}
+        self.sources = {}
+        self.env_path = None
+        self.port = 8097
+        self.login_enabled = False
+        self.readonly = False
+        self.output = []
+
+    def write(self, chunk):
+        self.output.append(chunk)
+
+
+_client = visdom.Visdom(send=False, use_incoming_socket=False)
+_rng = np.random.RandomState(0)
+
+
+def line_args(win, points, eid=EID, update=None):
+    """Message of the python client creating, or appending to, a line plot"""
+    # titled plots with named traces, as compare_envs merges only those
+    opts = None if update else {"title": win, "legend": ["y"]}
+    msg, _ = _client.line(
+        Y=_rng.rand(points),
+        X=np.arange(points),
+        win=win,
+        env=eid,
+        update=update,
+        opts=opts,
+    )
+    return msg
+
+
+def make_env(windows, points):
+    jsons = {}
+    for i in range(windows):
+        p = window(line_args("win_{}".format(i), points))
+        p["i"] = i
+        jsons[p["id"]] = p
+    return {"jsons": jsons, "reload": {}}
+
+
+class Window:
+    params = [[10**2, 10**3, 10**4, 10**5]]
+    param_names = ["points"]
+
+    def setup(self, points):
+        self.args = line_args("win", points)
+
+    def time_window(self, points):
+        window(self.args)
+
+
+class RegisterWindow:
+    params = [[10, 100, 1000], [0, 10, 100]]
+    param_names = ["windows", "subs"]
+
+    def setup(self, windows, subs):
+        self.handler = FakeHandler({EID: make_env(windows, 100)}, subs)
+        self.p = window(line_args("new_win", 100))
+
+    def time_register_window(self, windows, subs):
+        register_window(self.handler, self.p, EID)
+
+
+class UpdatePacket:
+    """Appending to a window holding more and more points"""
+
+    params = [[10**2, 10**3, 10**4, 10**5], [1, 100]]
+    param_names = ["points", "appended"]
+    number = 1  # the update modifies the window, use a new one for each call
+
+    def setup(self, points, appended):
+        self.p = window(line_args("win", points))
+        self.args = line_args("win", appended, update="append")
+
+    def time_update_packet(self, points, appended):
+        UpdateHandler.update_packet(self.p, self.args)
+
+
+class AppendSequence:
+    """A client appending to a window over and over, through the handler"""
+
+    params = [[10, 100, 300], [1, 10], [0, 10]]
+    param_names = ["appends", "appended", "subs"]
+    number = 1
+    timeout = 600
+
+    def setup(self, appends, appended, subs):
+        self.handler = FakeHandler({EID: make_env(1, appended)}, subs)
+        self.appends = [
+            line_args("win_0", appended, update="append") for _ in range(appends)
+        ]
+
+    def time_append_sequence(self, appends, appended, subs):
+        for args in self.appends:
+            UpdateHandler.wrap_func(self.handler, args)
+
+
+def heatmap_args(win, rows, columns, eid=EID, update=None):
+    """Message of the python client creating, or growing, a heatmap"""
+    msg, _ = _client.heatmap(
+        X=_rng.rand(rows, columns), win=win, env=eid, update=update
+    )
+    return msg
+
+
+class HeatmapSequence:
+    """A heatmap growing by a row or a column per update, through the handler"""
+
+    params = [[10, 100, 300], ["appendRow", "prependRow", "prependColumn"]]
+    param_names = ["updates", "direction"]
+    number = 1
+
+    def setup(self, updates, direction):
+        self.handler = FakeHandler(num_subs=10)
+        register_window(self.handler, window(heatmap_args("win", 100, 100)), EID)
+        shape = (1, 100) if direction.endswith("Row") else (100, 1)
+        self.updates = [
+            heatmap_args("win", *shape, update=direction) for _ in range(updates)
+        ]
+
+    def time_heatmap_sequence(self, updates, direction):
+        for args in self.updates:
+            UpdateHandler.wrap_func(self.handler, args)
+
+
+class HeatmapGrowth:
+    """
+    10 rows or columns added to heatmaps of 100 columns and of more and more
+    rows: appends take the same time whatever the size, while prepends shift
+    the rows, or every row for columns.
+    """
+
+    params = [
+        [10**2, 10**3, 10**4],
+        ["appendRow", "prependRow", "appendColumn", "prependColumn"],
+    ]
+    param_names = ["rows", "direction"]
+    number = 1
+
+    def setup(self, rows, direction):
+        self.handler = FakeHandler(num_subs=10)
+        register_window(self.handler, window(heatmap_args("win", rows, 100)), EID)
+        shape = (1, 100) if direction.endswith("Row") else (rows, 1)
+        self.updates = [
+            heatmap_args("win", *shape, update=direction) for _ in range(10)
+        ]
+
+    def time_heatmap_growth(self, rows, direction):
+        for args in self.updates:
+            UpdateHandler.wrap_func(self.handler, args)
+
+
+class UpdateWindow:
+    params = [[10**2, 10**4]]
+    param_names = ["points"]
+
+    def setup(self, points):
+        self.p = window(line_args("win", points))
+        self.args = {"opts": {"title": "updated"}, "layout": {"showlegend": True}}
+
+    def time_update_window(self, points):
+        update_window(self.p, self.args)
+
+
+class Broadcast:
+    params = [[1, 10, 100], [10**2, 10**4]]
+    param_names = ["subs", "points"]
+
+    def setup(self, subs, points):
+        self.handler = FakeHandler({EID: make_env(1, points)}, subs)
+        self.p = self.handler.state[EID]["jsons"]["win_0"]
+
+    def time_broadcast(self, subs, points):
+        broadcast(self.handler, self.p, EID)
+
+
+class Stringify:
+    params = [[10**2, 10**3, 10**4, 10**5]]
+    param_names = ["points"]
+
+    def setup(self, points):
+        self.p = window(line_args("win", points))
+
+    def time_stringify(self, points):
+        stringify(self.p)
+
+
+class LoadEnv:
+    params = [[10, 100, 1000], [10**2, 10**3]]
+    param_names = ["windows", "points"]
+
+    def setup(self, windows, points):
+        self.state = {EID: make_env(windows, points)}
+        self.socket = FakeSocket()
+
+    def time_load_env(self, windows, points):
+        load_env(self.state, EID, self.socket, env_path=None)
+
+
+class CompareEnvs:
+    params = [[2, 4], [10, 100], [10**2, 10**3]]
+    param_names = ["envs", "windows", "points"]
+
+    def setup(self, envs, windows, points):
+        self.eids = ["{}_{}".format(EID, i) for i in range(envs)]
+        self.state = {eid: make_env(windows, points) for eid in self.eids}
+
+    def time_compare_envs(self, envs, windows, points):
+        compare_envs(self.state, self.eids, FakeSocket(), env_path=None)
+
+
+class SerializeEnv:
+    params = [[10, 100, 1000], [10**2, 10**3]]
+    param_names = ["windows", "points"]
+
+    def setup(self, windows, points):
+        self.env_path = tempfile.mkdtemp()
+        self.state = {EID: make_env(windows, points)}
+
+    def teardown(self, windows, points):
+        shutil.rmtree(self.env_path)
+
+    def time_serialize_env(self, windows, points):
+        serialize_env(self.state, [EID], env_path=self.env_path)
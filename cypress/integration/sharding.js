@@ -0,0 +1,29 @@
+/* eslint-disable no-undef */
+before(() => {
+  cy.visit('/');
+});
+
+describe('Test Sharded Envs', () => {
+  // with -num_shards 2, shard_fork_local is owned by the shard of shard_fork
+  // and shard_fork_remote by the other one
+  const env = 'shard_fork';
+
+  it('Forks envs on the same and on other shards', () => {
+    cy.run('text_fork_part1', { env: env })
+      .get('.layout .react-grid-item')
+      .first()
+      .contains('This text will change. Fork to the rescue!');
+
+    ['shard_fork_local', 'shard_fork_remote'].forEach((fork) => {
+      cy.request('POST', '/fork_env', { prev_eid: env, eid: fork })
+        .its('body')
+        .should('eq', fork);
+
+      cy.close_envs();
+      cy.open_env(fork)
+        .get('.layout .react-grid-item')
+        .first()
+        .contains('This text will change. Fork to the rescue!');
+    });
+  });
+});
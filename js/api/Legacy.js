@@ -1,4 +1,4 @@
-import { POLLING_INTERVAL } from '../settings.js';
+import { LONG_POLL_TIMEOUT } from '../settings.js';
 
 function postData(url = ``, data = {}) {
   return fetch(url, {
@@ -38,13 +38,14 @@ class Poller {
 
   finishSetup = (sid) => {
     this.sid = sid;
-    this.poller_id = window.setInterval(() => this.poll(), POLLING_INTERVAL);
+    this.active = true;
     this.onConnect(true);
+    this.poll();
   };
 
   close = () => {
+    this.active = false;
     this.onDisconnect();
-    window.clearInterval(this.poller_id);
   };
 
   send = (msg) => {
@@ -55,9 +56,8 @@ class Poller {
         (result) => {
           if (!result.success) {
             this.close();
-          } else {
-            this.poll(); // Get a response right now if there is one
           }
+          // Any response is delivered to the pending long-poll query
         },
         () => {
           this.close();
@@ -66,8 +66,17 @@ class Poller {
   };
 
   poll = () => {
-    // Post message to query possible socket messages
-    postData(this.target, { message_type: 'query', sid: this.sid })
+    // Post message to query possible socket messages. The server holds the
+    // request open until messages are available, so the next query is sent
+    // as soon as this one returns.
+    if (!this.active) {
+      return;
+    }
+    postData(this.target, {
+      message_type: 'query',
+      sid: this.sid,
+      timeout: LONG_POLL_TIMEOUT,
+    })
       .then((res) => res.json())
       .then(
         (result) => {
@@ -81,6 +90,7 @@ class Poller {
               // TODO Could refactor message parsing out elsewhere.
               this.onmessage({ data: msg });
             });
+            this.poll();
           }
         },
         () => {
@@ -20,6 +20,7 @@ import lasso from '../lasso';
 import Pane from './Pane';
 
 const SCALE_RADIUS = 2000;
+const PREFETCH_NEIGHBORS = 8; // entities whose previews the client may prefetch
 
 class EmbeddingsPane extends React.Component {
   onEvent = (e) => {
@@ -48,13 +49,14 @@ class EmbeddingsPane extends React.Component {
     }
   };
 
-  onEntitySelection = (e) => {
+  onEntitySelection = (e, neighborIdxs) => {
     if (this.props.isFocused)
       this.context.sendPaneMessage(
         {
           event_type: 'EntitySelected',
           entityId: e.name,
           idx: e.idx,
+          neighborIdxs: neighborIdxs,
           pane_data: false, // No need to send the full data for this
         },
         this.props.id,
@@ -105,8 +107,20 @@ class EmbeddingsPane extends React.Component {
   };
 
   render() {
+    // progress of the embeddings being computed by the python client
+    const widgets = this.props.content.progress
+      ? [
+          <span className="widget" key="progress">
+            {this.props.content.progress}
+          </span>,
+        ]
+      : [];
     return (
-      <Pane {...this.props} handleDownload={this.handleDownload}>
+      <Pane
+        {...this.props}
+        handleDownload={this.handleDownload}
+        widgets={widgets}
+      >
         {this.props.content.isLoading ? (
           <div
             style={{
@@ -416,12 +430,30 @@ class Scene extends React.Component {
     if (!this.state.hovered || this.state.hovered !== datum) {
       this.setState({ detailsLoading: true });
       this.debouncedFn(() => {
-        this.props.onSelect(datum);
+        this.props.onSelect(datum, this.nearestIdxs(datum, PREFETCH_NEIGHBORS));
       });
     }
     this.setState({ hovered: datum });
   }
 
+  // indices of the entities closest to a datum in the layout
+  nearestIdxs(datum, count) {
+    const [x, y] = datum.position;
+    let nearest = [];
+    for (let other of this.generated_points) {
+      if (other === datum) continue;
+      const dx = other.position[0] - x;
+      const dy = other.position[1] - y;
+      const dist = dx * dx + dy * dy;
+      if (nearest.length < count || dist < nearest[nearest.length - 1].dist) {
+        nearest.push({ idx: other.idx, dist: dist });
+        nearest.sort((a, b) => a.dist - b.dist);
+        if (nearest.length > count) nearest.pop();
+      }
+    }
+    return nearest.map((n) => n.idx);
+  }
+
   hideTooltip() {
     this.setState({ hovered: null });
   }
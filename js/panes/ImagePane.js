@@ -15,6 +15,7 @@ import Pane from './Pane';
 
 const DEFAULT_HEIGHT = 400;
 const DEFAULT_WIDTH = 300;
+const PREFETCH_FRAMES = 2; // frames of a history loaded on each side
 
 function ImagePane(props) {
   const { sendPaneMessage } = useContext(ApiContext);
@@ -147,6 +148,17 @@ function ImagePane(props) {
     setActualSelected(selected);
   }, [selected]);
 
+  // prefetch the frames of a history next to the selected one, for the
+  // slider to show them without waiting for the server
+  useEffect(() => {
+    if (type !== 'image_history') return;
+    const first = Math.max(0, actualSelected - PREFETCH_FRAMES);
+    const last = Math.min(content.length - 1, actualSelected + PREFETCH_FRAMES);
+    for (let i = first; i <= last; i++) {
+      if (i !== actualSelected) new Image().src = content[i].src;
+    }
+  }, [actualSelected, content]);
+
   // Reset the image settings when the user resizes the window. Avoid
   // constantly resetting the zoom level when user has not zoomed.
   useEffect(() => {
@@ -36,14 +36,14 @@ const MODAL_STYLE = {
     transform: 'translate(-50%, -50%)',
   },
 };
-const POLLING_INTERVAL = 500;
+const LONG_POLL_TIMEOUT = 10; // seconds
 
 export {
   DEFAULT_LAYOUT,
+  LONG_POLL_TIMEOUT,
   MARGIN,
   MODAL_STYLE,
   PANE_SIZE,
   PANES,
-  POLLING_INTERVAL,
   ROW_HEIGHT,
 };
@@ -7,11 +7,20 @@
 # LICENSE file in the root directory of this source tree.
 
 from visdom.utils.shared_utils import get_new_window_id
+from visdom.utils.encoding_pool import EncodingPool
+from visdom.utils import reduction
 from visdom import server
 import os.path
 import requests
 import traceback
 import threading
+import atexit
+import tempfile
+import inspect
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import websocket  # type: ignore
 import json
 import hashlib
@@ -25,6 +34,7 @@ except ImportError:
 import math
 import re
 import base64
+import wave
 import numpy as np  # type: ignore
 from PIL import Image  # type: ignore
 import base64 as b64  # type: ignore
@@ -53,6 +63,8 @@ try:
     # faster but requires more setup
     import visdom.extra_deps.bhtsne.bhtsne as bhtsne
 
+    BHTSNE_AVAILABLE = True
+
     def do_tsne(X):
         num_entities = len(X)
 
@@ -75,6 +87,7 @@ try:
         return normY
 
 except ImportError:
+    BHTSNE_AVAILABLE = False
 
     def do_tsne(X):
         raise Exception(
@@ -88,6 +101,91 @@ except ImportError:
         )
 
 
+def pca_2d(X):
+    return reduction.normalize(reduction.randomized_pca(X))
+
+
+def landmark_2d(X):
+    # the landmarks are laid out with t-SNE when it is available
+    reduce = do_tsne if BHTSNE_AVAILABLE else reduction.randomized_pca
+    return reduction.normalize(reduction.landmark_projection(X, reduce))
+
+
+EMBEDDINGS_METHODS = {"tsne": do_tsne, "pca": pca_2d, "landmark": landmark_2d}
+
+
+def compute_embeddings(X, method, rows=None):
+    """
+    Positions in [-1, 1] x [-1, 1] of the features X, or of the features of
+    the .npy file at path X, which are then mapped instead of loaded. With
+    `rows`, only the features of these rows are laid out, and read.
+    """
+    if isinstance(X, str):
+        X = np.load(X, mmap_mode="r")
+    if rows is not None:
+        X = np.take(X, rows, axis=0)
+    return EMBEDDINGS_METHODS[method](X)
+
+
+def _npy_file(features):
+    """
+    Path of the .npy file that the memmap `features` maps as a whole, for
+    other processes to map it too, or None.
+    """
+    if not isinstance(features, np.memmap) or features.filename is None:
+        return None
+    try:
+        mapped = np.load(features.filename, mmap_mode="r")
+    except (OSError, ValueError):
+        return None  # not a .npy file
+    if (mapped.shape, mapped.dtype, mapped.strides, mapped.offset) != (
+        features.shape,
+        features.dtype,
+        features.strides,
+        features.offset,
+    ):
+        return None  # a part of it, or a raw file mapped from the wrong offset
+    return features.filename
+
+
+_spilled_features = set()  # removed at exit if they are still there
+
+
+def _remove_spilled_features(path):
+    _spilled_features.discard(path)
+    try:
+        os.remove(path)
+    except OSError:
+        pass  # still mapped on Windows, or removed already
+
+
+@atexit.register
+def _remove_all_spilled_features():
+    for path in list(_spilled_features):
+        _remove_spilled_features(path)
+
+
+def spill_features(features, directory=None):
+    """
+    Write features to a temporary .npy file of `directory` and map it
+    read-only, so that they are paged in from the file when read instead of
+    held in memory. The file is removed when python exits.
+    """
+    features = np.asarray(features)
+    fd, path = tempfile.mkstemp(
+        prefix="visdom_embeddings_", suffix=".npy", dir=directory
+    )
+    os.close(fd)
+    spilled = np.lib.format.open_memmap(
+        path, mode="w+", dtype=features.dtype, shape=features.shape
+    )
+    spilled[...] = features
+    spilled.flush()
+    del spilled
+    _spilled_features.add(path)
+    return np.load(path, mmap_mode="r")
+
+
 here = os.path.abspath(os.path.dirname(__file__))
 
 try:
@@ -100,6 +198,12 @@ logging.getLogger("requests").setLevel(logging.CRITICAL)
 logging.getLogger("urllib3").setLevel(logging.CRITICAL)
 logger = logging.getLogger(__name__)
 
+POLLING_INTERVAL = 0.1  # seconds
+LONG_POLL_TIMEOUT = 10  # seconds
+EMBEDDINGS_WORKERS = 2
+EMBEDDINGS_CACHE_SIZE = 16  # selections per embeddings window
+EMBEDDINGS_PREVIEW_CACHE_SIZE = 256  # hover previews per embeddings window
+
 
 def get_rand_id():
     return str(hex(int(time.time() * 10000000))[2:])
@@ -360,6 +464,22 @@ def _assert_opts(opts):
             opts.get("jpgquality") > 0 and opts.get("jpgquality") <= 100
         ), "JPG quality should be number between 0 and 100"
 
+    if opts.get("history_size") is not None:
+        assert isinstance(
+            opts.get("history_size"), int
+        ), "history_size should be an integer"
+        assert opts.get("history_size") > 0, "history_size must be greater than 0"
+
+    if opts.get("undo_depth") is not None:
+        assert isinstance(
+            opts.get("undo_depth"), int
+        ), "undo_depth should be an integer"
+        assert opts.get("undo_depth") > 0, "undo_depth must be greater than 0"
+
+    if opts.get("downscale") is not None:
+        assert isinstance(opts.get("downscale"), int), "downscale should be an integer"
+        assert opts.get("downscale") > 0, "downscale must be greater than 0"
+
     if opts.get("opacity"):
         assert isnum(opts.get("opacity")), "opacity should be a number"
         assert (
@@ -406,6 +526,20 @@ def _to_numpy(a):
     return a
 
 
+def _downscale(tensor, factor):
+    """Average the pixels of the last two dimensions by `factor` x `factor`"""
+    if factor == 1:
+        return tensor
+    height = tensor.shape[-2] // factor
+    width = tensor.shape[-1] // factor
+    tensor = tensor[..., : height * factor, : width * factor]
+    blocks = tensor.reshape(tensor.shape[:-2] + (height, factor, width, factor))
+    blocks = blocks.mean(axis=(-3, -1))
+    if not np.issubdtype(tensor.dtype, np.floating):
+        blocks = blocks.astype(tensor.dtype)
+    return blocks
+
+
 def pytorch_wrap(f):
     @wraps(f)
     def wrapped_f(*args, **kwargs):
@@ -416,6 +550,38 @@ def pytorch_wrap(f):
     return wrapped_f
 
 
+def media_job(f):
+    """
+    Runs a media function on the encoding pool of the client if it has one,
+    returning the future of its result instead of waiting for it.
+    """
+    signature = inspect.signature(f)
+
+    @wraps(f)
+    def wrapped_f(self, *args, **kwargs):
+        pool = self._encoding_pool
+        if pool is None or pool.in_worker():
+            return f(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        # the window id is picked now for the frames to replace each other
+        if arguments["win"] is None:
+            arguments["win"] = "window_" + get_rand_id()
+        # the caller may reuse its arrays and opts for the next frames
+        for name, value in arguments.items():
+            if isinstance(value, (np.ndarray, list)):
+                arguments[name] = np.array(value)
+        if arguments["opts"] is not None:
+            arguments["opts"] = dict(arguments["opts"])
+        key = (arguments["env"] or self.env, arguments["win"])
+        # every frame is kept in a history, in order
+        replace = not (arguments["opts"] or {}).get("store_history")
+        return pool.submit(key, lambda: f(*bound.args, **bound.kwargs), replace)
+
+    return wrapped_f
+
+
 class Visdom(object):
     def __init__(
         self,
@@ -436,6 +602,8 @@ class Visdom(object):
         proxies=None,
         offline=False,
         use_polling=False,
+        media_workers=0,
+        media_queue_size=8,
     ):
         parsed_url = urlparse(server)
         if not parsed_url.scheme:
@@ -486,6 +654,14 @@ class Visdom(object):
             self.password = hashlib.sha256(password.encode("utf-8")).hexdigest()
 
         self.win_data = {}
+        # media are encoded and sent on worker threads if asked for
+        self._encoding_pool = None
+        if media_workers > 0:
+            self._encoding_pool = EncodingPool(media_workers, media_queue_size)
+            atexit.register(self._encoding_pool.flush)
+        self._embeddings_pool = None  # started by the first embeddings
+        self._preview_pool = None  # renders the hover previews of embeddings
+
         if self.offline:
             self.use_socket = False
             assert (
@@ -595,16 +771,28 @@ class Visdom(object):
             resp = json.loads(resp_json)
             self.vis_sid = resp["sid"]
             while self.use_socket:
+                # The server holds the query open until messages arrive
+                query_start = time.time()
                 resp_json = self._handle_post(
                     "{0}:{1}{2}/vis_socket_wrap".format(
                         self.server, self.port, self.base_url
                     ),
-                    data=json.dumps({"message_type": "query", "sid": self.vis_sid}),
+                    data=json.dumps(
+                        {
+                            "message_type": "query",
+                            "sid": self.vis_sid,
+                            "timeout": LONG_POLL_TIMEOUT,
+                        }
+                    ),
                 )
                 resp = json.loads(resp_json)
                 for msg in resp["messages"]:
                     on_message(msg)
-                time.sleep(0.1)
+                # Servers without long-poll support answer empty queries
+                # immediately, so fall back to the regular polling interval
+                elapsed = time.time() - query_start
+                if len(resp["messages"]) == 0 and elapsed < POLLING_INTERVAL:
+                    time.sleep(POLLING_INTERVAL - elapsed)
 
         # Start listening thread
         self.socket_thread = threading.Thread(
@@ -778,6 +966,29 @@ class Visdom(object):
                     traceback.print_exc()
                 return False
 
+    def _media_src(self, bytestr, mimetype):
+        """
+        Return the url of media uploaded to the server, to reference them in
+        a window without embedding them. The media are embedded as a data URI
+        if they are not sent to a server, or if it does not store them, and
+        when the events are logged, for the log to be replayable anywhere.
+        """
+        if self.send and not self.offline and self.log_to_filename is None:
+            try:
+                r = self.session.post(
+                    "{0}:{1}{2}/blob".format(self.server, self.port, self.base_url),
+                    data=bytestr,
+                    headers={"Content-Type": mimetype},
+                )
+                if r.status_code == 200:
+                    return r.text
+            except (requests.RequestException, requests.ConnectionError):
+                pass  # sending the window reports the connection errors
+        return "data:%s;base64,%s" % (
+            mimetype,
+            base64.b64encode(bytestr).decode("utf-8"),
+        )
+
     def save(self, envs):
         """
         This function allows the user to save envs that are alive on the
@@ -899,6 +1110,15 @@ class Visdom(object):
             self.socket_alive or not self.use_socket
         )
 
+    def flush_media(self, timeout=None):
+        """
+        Wait for the images, audio and videos being encoded to be sent to the
+        server, returns whether they are all sent within `timeout` seconds.
+        """
+        if self._encoding_pool is None:
+            return True
+        return self._encoding_pool.flush(timeout)
+
     def check_connection(self, timeout_seconds=0):
         """
         This function returns a bool indicating whether or
@@ -1110,75 +1330,271 @@ class Visdom(object):
         except ImportError:
             raise RuntimeError("Plotly must be installed to plot Plotly figures")
 
+    def _get_embeddings_pool(self):
+        """
+        Pool computing the embeddings of the selected regions out of the
+        threads of the client. Its workers are started by a fork server, or
+        spawned where there is none, as forking the threads of the client
+        could deadlock. They run the top-level compute_embeddings, and import
+        the main module of the user like any multiprocessing worker. The pool
+        is shut down at exit.
+        """
+        if self._embeddings_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            else:
+                context = multiprocessing.get_context("spawn")
+            self._embeddings_pool = ProcessPoolExecutor(
+                EMBEDDINGS_WORKERS, mp_context=context
+            )
+            atexit.register(self._close_embeddings_pool)
+        return self._embeddings_pool
+
+    def _close_embeddings_pool(self):
+        """Cancel the embeddings not computed yet and stop the workers"""
+        pool, self._embeddings_pool = self._embeddings_pool, None
+        if pool is None:
+            return
+        for win_data in list(self.win_data.values()):
+            job = win_data.get("job")
+            if job is not None:
+                job.cancel()
+        pool.shutdown(wait=False)
+
+    def _embeddings_pool_broke(self, pool):
+        """
+        Compute the embeddings on a thread of the client once the workers of
+        the pool died, e.g. when they could not import the main module
+        """
+        if self._embeddings_pool is pool:
+            logger.warning(
+                "The embeddings workers stopped, computing the embeddings of the "
+                "selected regions in the client instead. Is the main module "
+                'guarded by `if __name__ == "__main__":`?'
+            )
+            self._embeddings_pool = ThreadPoolExecutor(1)
+        pool.shutdown(wait=False)
+
+    def _send_embeddings_progress(self, win, env, opts, progress):
+        self._send(
+            {
+                "data": {"update_type": "Progress", "progress": progress},
+                "win": win,
+                "eid": env,
+                "opts": opts,
+            },
+            endpoint="update",
+        )
+
+    def _select_embeddings(self, win, selection, on_done):
+        """
+        Run t-SNE on the features of the selected entities of an embeddings
+        window on the pool, then call `on_done` with their positions. Results
+        are cached by selection, and a new selection supersedes the one being
+        computed: its job is cancelled if it did not start yet, and its result
+        is only cached otherwise.
+        """
+        win_data = self.win_data[win]
+        key = hashlib.sha1(np.asarray(selection, dtype=np.int64).tobytes()).hexdigest()
+        with win_data["lock"]:
+            if win_data["job"] is not None:
+                win_data["job"].cancel()
+                win_data["job"] = None
+            Y = win_data["cache"].get(key)
+            if Y is not None:
+                win_data["cache"].move_to_end(key)
+        if Y is not None:
+            on_done(Y)
+            return
+
+        env, opts = win_data["env"], win_data["opts"]
+        self._send_embeddings_progress(
+            win,
+            env,
+            opts,
+            "Computing the embeddings of %d entities..." % len(selection),
+        )
+        if win_data["npy_file"] is not None:
+            # the workers map the file and read the selected rows themselves
+            args = (win_data["npy_file"], win_data["method"], selection)
+        else:
+            args = (
+                np.take(win_data["features"], selection, axis=0),
+                win_data["method"],
+            )
+        pool = self._get_embeddings_pool()
+        try:
+            job = pool.submit(compute_embeddings, *args)
+        except BrokenProcessPool:
+            self._embeddings_pool_broke(pool)
+            pool = self._get_embeddings_pool()
+            job = pool.submit(compute_embeddings, *args)
+
+        def job_done(job):
+            if job.cancelled():
+                return
+            with win_data["lock"]:
+                current = win_data["job"] is job
+                if current:
+                    win_data["job"] = None
+            try:
+                Y = job.result()
+            except BrokenProcessPool:
+                self._embeddings_pool_broke(pool)
+                if current:
+                    self._select_embeddings(win, selection, on_done)
+                return
+            except Exception as e:
+                if current:
+                    self._send_embeddings_progress(
+                        win, env, opts, "Computing the embeddings failed: %s" % e
+                    )
+                return
+            with win_data["lock"]:
+                win_data["cache"][key] = Y
+                while len(win_data["cache"]) > EMBEDDINGS_CACHE_SIZE:
+                    win_data["cache"].popitem(last=False)
+            if current:
+                on_done(Y)
+
+        with win_data["lock"]:
+            win_data["job"] = job
+        job.add_done_callback(job_done)
+
+    def _embeddings_preview(self, win_data, idx):
+        """Hover preview of an entity, rendered by the data_getter if needed"""
+        previews = win_data["previews"]
+        preview = previews.get(idx)
+        if preview is not None:
+            previews.move_to_end(idx)
+            return preview
+        if win_data["data"] is None:
+            preview = {"html": "<div>No preview available</div>"}
+        elif win_data["data_type"] == "html":
+            preview = {"html": win_data["data"](idx)}
+        preview["entityId"] = "Entity {}".format(idx)
+        previews[idx] = preview
+        while len(previews) > EMBEDDINGS_PREVIEW_CACHE_SIZE:
+            previews.popitem(last=False)
+        return preview
+
+    def _hover_embeddings(self, win, idx, neighbor_idxs):
+        """
+        Send the preview of the hovered entity of an embeddings window, then
+        if the window prefetches previews, send the previews of its nearest
+        entities in the layout for the server to cache them.
+        """
+        win_data = self.win_data[win]
+        env, opts = win_data["env"], win_data["opts"]
+        self._send(
+            {
+                "data": {
+                    "update_type": "EntitySelected",
+                    "selected": self._embeddings_preview(win_data, idx),
+                    "idx": idx,
+                },
+                "win": win,
+                "eid": env,
+                "opts": opts,
+            },
+            endpoint="update",
+        )
+        if not opts.get("prefetch_previews") or win_data["data"] is None:
+            return
+        previews = {
+            i: self._embeddings_preview(win_data, i)
+            for i in map(int, neighbor_idxs)
+            if i not in win_data["previews"]
+        }
+        if len(previews) > 0:
+            self._send(
+                {
+                    "data": {"update_type": "Previews", "previews": previews},
+                    "win": win,
+                    "eid": env,
+                    "opts": opts,
+                },
+                endpoint="update",
+            )
+
     def _register_embeddings(
-        self, features, labels, points, data_getter, data_type, win, env, opts
+        self, features, labels, data_getter, data_type, win, env, opts, features_file
     ):
+        previous = self.win_data.get(win)
+        if previous is not None and previous["features_file"] is not None:
+            _remove_spilled_features(previous["features_file"])
         self.win_data[win] = {
-            "features": features,
+            "features": features,  # only the selected rows are read
+            "features_file": features_file,  # spilled by embeddings()
+            "npy_file": _npy_file(features),  # mapped by the workers
             "labels": labels,
-            "points": points,
             "data": data_getter,
             "data_type": data_type,
             "env": env,
             "opts": opts,
+            "method": opts["method"],
+            "previews": OrderedDict(),  # hover previews by entity index
+            "cache": OrderedDict(),  # positions by hash of the selection
+            "job": None,  # the selection being computed
+            "lock": threading.Lock(),
         }
 
         def embedding_event_handler(event):
             window = event["target"]
             if event["event_type"] == "EntitySelected":
                 # Hover events lead us to get the expected element and serve
-                # them via an append event
-                entity_id = event["entityId"]
-                id = event["idx"]
-                if data_getter is not None:
-                    if data_type == "html":
-                        selected = {"html": data_getter(int(id))}
-                else:
-                    selected = {"html": "<div>No preview available</div>"}
-
-                selected["entityId"] = entity_id
-                send_data = {"update_type": "EntitySelected", "selected": selected}
-                self._send(
-                    {
-                        "data": send_data,
-                        "win": window,
-                        "eid": env,
-                        "opts": opts,
-                    },
-                    endpoint="update",
-                )
+                # them via an update event, away from the thread receiving the
+                # events. A hover supersedes the pending one of its window.
+                idx = int(event["idx"])
+                neighbor_idxs = event.get("neighborIdxs", [])
+
+                def hover():
+                    try:
+                        self._hover_embeddings(window, idx, neighbor_idxs)
+                    except Exception as e:
+                        logger.warning(
+                            "Visdom failed to send the preview of entity %d: %s",
+                            idx,
+                            e,
+                        )
+
+                if self._preview_pool is None:
+                    self._preview_pool = EncodingPool(name="Visdom-Previews")
+                self._preview_pool.submit(window, hover)
             elif event["event_type"] == "RegionSelected":
-                # lasso events give us a subset of the data to re-run tsne on
-                # so we generate
+                # lasso events give us a subset of the data to re-run tsne on,
+                # away from the thread receiving the events
                 selection = event["selectedIdxs"]
-                sub_features = np.take(features, selection, axis=0)
-                Y = do_tsne(sub_features)
-                label_set = list(set(labels))
-                points = [
-                    {
-                        "group": int(label_set.index(labels[i])),
-                        "name": "Entity {}".format(i),
-                        "position": xy,
-                        "label": labels[i],
-                        "idx": i,
+
+                def send_region(Y):
+                    label_set = list(set(labels))
+                    points = [
+                        {
+                            "group": int(label_set.index(labels[i])),
+                            "name": "Entity {}".format(i),
+                            "position": xy,
+                            "label": labels[i],
+                            "idx": i,
+                        }
+                        for i, xy in zip(selection, Y)
+                    ]
+                    send_data = {
+                        "update_type": "RegionSelected",
+                        "points": points,
                     }
-                    for i, xy in zip(selection, Y)
-                ]
-                send_data = {
-                    "update_type": "RegionSelected",
-                    "points": points,
-                }
+                    self._send(
+                        {
+                            "data": send_data,
+                            "win": window,
+                            "eid": env,
+                            "opts": opts,
+                        },
+                        endpoint="update",
+                    )
+
+                self._select_embeddings(window, selection, send_region)
             else:
                 return  # Unsupported event
-            self._send(
-                {
-                    "data": send_data,
-                    "win": window,
-                    "eid": env,
-                    "opts": opts,
-                },
-                endpoint="update",
-            )
 
         self.register_event_handler(embedding_event_handler, win)
 
@@ -1191,6 +1607,7 @@ class Visdom(object):
         win=None,
         env=None,
         opts=None,
+        mmap_dir=None,
     ):
         """
         This function handles taking arbitrary features and compiling them into
@@ -1205,10 +1622,40 @@ class Visdom(object):
         only data_type supported is 'html', which means your data_getter takes
         in an index into features that is currently selected and returns
         the html for what you'd like to display.
+
+        The features are kept to compute the embeddings of the regions selected
+        in the pane. If `mmap_dir` is given, they are written to a temporary
+        .npy file of this directory and kept memory-mapped, and the embeddings
+        only read the rows they need. Features that are a `np.memmap` already
+        are kept as they are.
+
+        The following `opts` are supported:
+
+        - `opts.method`: how the features are laid out in 2d: `tsne` with
+            bhtsne, `pca` for a randomized PCA, or `landmark` to lay out a
+            subsample of landmarks with t-SNE (or PCA without bhtsne) and place
+            the other entities next to their nearest landmarks. The last two
+            only need NumPy. (`string`; default = `tsne` if bhtsne is
+            installed, `landmark` otherwise)
+        - `opts.prefetch_previews`: with a data_getter, also render the
+            previews of the entities next to the hovered one in the layout,
+            for the server to show them without asking the client when they
+            are hovered. (`boolean`; default = `false`)
+        - `opts.undo_depth`: number of the last layouts the pane can go back
+            to from the regions selected in it. (`integer` > 0; default = all
+            of them)
         """
         opts = {} if opts is None else opts
+        opts["method"] = opts.get("method", "tsne" if BHTSNE_AVAILABLE else "landmark")
         _title2str(opts)
         _assert_opts(opts)
+        assert opts["method"] in EMBEDDINGS_METHODS, (
+            "unknown embeddings method: %s" % opts["method"]
+        )
+        features_file = None
+        if mmap_dir is not None and not isinstance(features, np.memmap):
+            features = spill_features(features, mmap_dir)
+            features_file = features.filename
 
         loading_message = {
             "content": {"isLoading": True},
@@ -1224,7 +1671,7 @@ class Visdom(object):
             endpoint="events",
         )
 
-        Y = do_tsne(features)
+        Y = compute_embeddings(features, opts["method"])
 
         label_set = list(set(labels))
         points = [
@@ -1258,11 +1705,12 @@ class Visdom(object):
         # TODO allow disabling this in a way that pushes onus for calculating
         # to the server or frontend client
         self._register_embeddings(
-            features, labels, points, data_getter, data_type, win, env, opts
+            features, labels, data_getter, data_type, win, env, opts, features_file
         )
         return win
 
     @pytorch_wrap
+    @media_job
     def image(self, img, win=None, env=None, opts=None):
         """
         This function draws an img. It takes as input an `CxHxW` or `HxW` tensor
@@ -1324,6 +1772,7 @@ class Visdom(object):
         )
 
     @pytorch_wrap
+    @media_job
     def images(self, tensor, nrow=8, padding=2, win=None, env=None, opts=None):
         """
         Given a 4D tensor of shape (B x C x H x W),
@@ -1335,6 +1784,9 @@ class Visdom(object):
         https://github.com/pytorch/vision/blob/master/torchvision/utils.py
         """
 
+        opts = {} if opts is None else opts
+        _assert_opts(opts)
+
         # If list of images, convert to a 4D tensor
         if isinstance(tensor, list):
             tensor = np.stack(tensor, 0)
@@ -1342,35 +1794,49 @@ class Visdom(object):
         if tensor.ndim == 2:  # single image H x W
             tensor = np.expand_dims(tensor, 0)
         if tensor.ndim == 3:  # single image
+            tensor = _downscale(tensor, opts.get("downscale", 1))
             if tensor.shape[0] == 1:  # if single-channel, convert to 3-channel
                 tensor = np.repeat(tensor, 3, 0)
             return self.image(tensor, win, env, opts)
-        if tensor.ndim == 4 and tensor.shape[1] == 1:  # single-channel images
-            tensor = np.repeat(tensor, 3, 1)
+        tensor = _downscale(tensor, opts.get("downscale", 1))
 
-        # make 4D tensor of images into a grid
-        nmaps = tensor.shape[0]
+        # make 4D tensor of images into a grid, of 8-bit pixels as image does
+        nmaps, nchannels, img_height, img_width = tensor.shape
         xmaps = min(nrow, nmaps)
         ymaps = int(math.ceil(float(nmaps) / xmaps))
-        height = int(tensor.shape[2] + 2 * padding)
-        width = int(tensor.shape[3] + 2 * padding)
-
-        grid = np.ones([tensor.shape[1], height * ymaps, width * xmaps])
-        k = 0
-        for y in range(ymaps):
-            for x in range(xmaps):
-                if k >= nmaps:
-                    break
-                h_start = y * height + 1 + padding
-                h_end = h_start + tensor.shape[2]
-                w_start = x * width + 1 + padding
-                w_end = w_start + tensor.shape[3]
-                grid[:, h_start:h_end, w_start:w_end] = tensor[k]
-                k += 1
+        height = int(img_height + 2 * padding)
+        width = int(img_width + 2 * padding)
+
+        # single-channel images are shown in gray
+        nchannels = 3 if nchannels == 1 else nchannels
+        # images in [0, 1] are scaled, the padding being white
+        scale = 255 if tensor.max() <= 1 else 1
+        grid = np.full([nchannels, ymaps, height, xmaps, width], scale, dtype=np.uint8)
+        # the tiles as a (y, x, C, H, W) view of the grid, filled in one go
+        # for the complete rows and then for the last one
+        tiles = grid.transpose(1, 3, 0, 2, 4)[
+            ..., padding : padding + img_height, padding : padding + img_width
+        ]
+        rows = nmaps // xmaps
+        np.multiply(
+            tensor[: rows * xmaps].reshape(rows, xmaps, -1, img_height, img_width),
+            scale,
+            out=tiles[:rows],
+            casting="unsafe",
+        )
+        if rows < ymaps:
+            np.multiply(
+                tensor[rows * xmaps :],
+                scale,
+                out=tiles[rows, : nmaps - rows * xmaps],
+                casting="unsafe",
+            )
 
+        grid = grid.reshape(nchannels, ymaps * height, xmaps * width)
         return self.image(grid, win, env, opts)
 
     @pytorch_wrap
+    @media_job
     def audio(self, tensor=None, audiofile=None, win=None, env=None, opts=None):
         """
         This function plays audio. It takes as input the filename of the audio
@@ -1380,9 +1846,13 @@ class Visdom(object):
         The following `opts` are supported:
 
         - `opts.sample_frequency`: sample frequency (`integer` > 0; default = 44100)
+        - `opts.format`: format the tensor is encoded to, `wav`, or `flac` and
+            `ogg` which require [soundfile](https://python-soundfile.readthedocs.io)
+            (`string`; default = `wav`)
         """
         opts = {} if opts is None else opts
         opts["sample_frequency"] = opts.get("sample_frequency", 44100)
+        opts["format"] = opts.get("format", "wav")
         _title2str(opts)
         _assert_opts(opts)
         assert (
@@ -1393,36 +1863,62 @@ class Visdom(object):
                 tensor.ndim == 2 and tensor.shape[1] == 2
             ), "tensor should be 1D vector or 2D matrix with 2 columns"
 
+        mimetypes = {"wav": "wav", "mp3": "mp3", "ogg": "ogg", "flac": "flac"}
         if tensor is not None:
-            import scipy.io.wavfile  # type: ignore
-            import tempfile
-
-            audiofile = os.path.join(
-                tempfile.gettempdir(), "%s.wav" % next(tempfile._get_candidate_names())
+            mimetype = opts["format"]
+            assert mimetype in ["wav", "ogg", "flac"], (
+                "unknown audio format: %s" % mimetype
             )
-            tensor = np.int16(tensor / np.max(np.abs(tensor)) * 32767)
-            scipy.io.wavfile.write(audiofile, opts.get("sample_frequency"), tensor)
-
-        extension = audiofile.split(".")[-1].lower()
-        mimetypes = {"wav": "wav", "mp3": "mp3", "ogg": "ogg", "flac": "flac"}
-        mimetype = mimetypes.get(extension)
-        assert mimetype is not None, "unknown audio type: %s" % extension
+            bytestr = self._encode_audio(
+                tensor, opts["sample_frequency"], opts["format"]
+            )
+        else:
+            extension = audiofile.split(".")[-1].lower()
+            mimetype = mimetypes.get(extension)
+            assert mimetype is not None, "unknown audio type: %s" % extension
+            bytestr = loadfile(audiofile)
 
-        bytestr = loadfile(audiofile)
         audiodata = """
             <audio controls>
-                <source type="audio/%s" src="data:audio/%s;base64,%s">
+                <source type="audio/%s" src="%s">
                 Your browser does not support the audio tag.
             </audio>
         """ % (
             mimetype,
-            mimetype,
-            base64.b64encode(bytestr).decode("utf-8"),
+            self._media_src(bytestr, "audio/" + mimetype),
         )
         opts["height"] = 80
         opts["width"] = 330
         return self.text(text=audiodata, win=win, env=env, opts=opts)
 
+    def _encode_audio(self, tensor, sample_frequency, audio_format):
+        """
+        Encode a waveform in memory, normalized to its peak. WAV files are
+        written with the standard library, FLAC and Ogg Vorbis ones with
+        soundfile, whose import is deferred as few users need it.
+        """
+        peak = np.max(np.abs(tensor))
+        if peak > 0:
+            tensor = tensor / peak
+        content = BytesIO()
+        if audio_format == "wav":
+            samples = np.int16(tensor * 32767)
+            with wave.open(content, "wb") as wav:
+                wav.setnchannels(1 if samples.ndim == 1 else samples.shape[1])
+                wav.setsampwidth(2)
+                wav.setframerate(sample_frequency)
+                wav.writeframes(samples.astype("<i2").tobytes())
+        else:
+            import soundfile  # type: ignore
+
+            soundfile.write(
+                content,
+                tensor.astype(np.float32),
+                sample_frequency,
+                format={"flac": "FLAC", "ogg": "OGG"}[audio_format],
+            )
+        return content.getvalue()
+
     def _encode(self, tensor, fps):
         """
         This follows the [PyAV cookbook]
@@ -1462,6 +1958,7 @@ class Visdom(object):
         return content, "mp4"
 
     @pytorch_wrap
+    @media_job
     def video(
         self, tensor=None, dim="LxHxWxC", videofile=None, win=None, env=None, opts=None
     ):
@@ -1510,15 +2007,14 @@ class Visdom(object):
         flags = " ".join([k for k in ("autoplay", "loop") if opts[k]])
 
         videodata = """
-            <video controls %s>
-                <source type="video/%s" src="data:video/%s;base64,%s">
+            <video controls preload="metadata" %s>
+                <source type="video/%s" src="%s">
                 Your browser does not support the video tag.
             </video>
         """ % (
             flags,
             mimetype,
-            mimetype,
-            base64.b64encode(bytestr).decode("utf-8"),
+            self._media_src(bytestr, "video/" + mimetype),
         )
         return self.text(text=videodata, win=win, env=env, opts=opts)
 
@@ -40,6 +40,8 @@ class Visdom:
         raise_exceptions: Optional[bool] = ...,
         use_incoming_socket: bool = ...,
         log_to_filename: _OptStr = ...,
+        media_workers: int = ...,
+        media_queue_size: int = ...,
     ) -> None: ...
     def _send(
         self, msg, endpoint: Text = ..., quiet: bool = ..., from_log: bool = ...
@@ -52,6 +54,7 @@ class Visdom:
     def delete_env(self, env: Text) -> _SendReturn: ...
     def win_exists(self, win: Text, env: _OptStr = ...) -> Optional[bool]: ...
     def check_connection(self) -> bool: ...
+    def flush_media(self, timeout: Optional[float] = ...) -> bool: ...
     def replay_log(self, log_filename: Text) -> None: ...
     def text(
         self,
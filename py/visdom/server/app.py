@@ -20,7 +20,12 @@ import tornado.web  # noqa E402: gotta install ioloop first
 import tornado.escape  # noqa E402: gotta install ioloop first
 
 from visdom.utils.shared_utils import warn_once, ensure_dir_exists, get_visdom_path
-from visdom.utils.server_utils import serialize_env, LazyEnvData
+from visdom.utils.server_utils import (
+    serialize_env,
+    read_env_file,
+    LazyEnvData,
+    PreviewCache,
+)
 from visdom.server.handlers.socket_handlers import (
     SocketHandler,
     SocketWrap,
@@ -28,6 +33,8 @@ from visdom.server.handlers.socket_handlers import (
     VisSocketWrap,
 )
 from visdom.server.handlers.web_handlers import (
+    BlobHandler,
+    BlobUploadHandler,
     CloseHandler,
     CompareHandler,
     DataHandler,
@@ -38,11 +45,17 @@ from visdom.server.handlers.web_handlers import (
     ExistsHandler,
     ForkEnvHandler,
     IndexHandler,
+    MetricsHandler,
     PostHandler,
+    ProfileHandler,
     SaveHandler,
+    StallsHandler,
+    StaticHandler,
     UpdateHandler,
     UserSettingsHandler,
 )
+from visdom.server.metrics import METRICS
+from visdom.server.blobs import BLOB_NAME, BlobStore
 from visdom.server.defaults import (
     DEFAULT_BASE_URL,
     DEFAULT_ENV_PATH,
@@ -71,9 +84,12 @@ class Application(tornado.web.Application):
         user_credential=None,
         use_frontend_client_polling=False,
         eager_data_loading=False,
+        bus=None,
+        production=False,
     ):
         self.eager_data_loading = eager_data_loading
         self.env_path = env_path
+        self.bus = bus
         self.state = self.load_state()
         self.layouts = self.load_layouts()
         self.user_settings = self.load_user_settings()
@@ -86,6 +102,13 @@ class Application(tornado.web.Application):
         self.login_enabled = False
         self.last_access = time.time()
         self.wrap_socket = use_frontend_client_polling
+        self.change_stream = None
+        self.stall_detector = None
+        # media are kept as files next to the envs, inline without env_path
+        self.blob_store = None
+        if env_path is not None:
+            self.blob_store = BlobStore(env_path, base_url)
+        self.previews = PreviewCache()
 
         if user_credential:
             self.login_enabled = True
@@ -93,7 +116,16 @@ class Application(tornado.web.Application):
                 tornado_settings["cookie_secret"] = fn.read()
 
         tornado_settings["static_url_prefix"] = self.base_url + "/static/"
-        tornado_settings["debug"] = True
+        # production servers cache the compiled templates and the hashes of
+        # the static files, and send precompressed static files
+        tornado_settings["debug"] = not production
+        tornado_settings["compiled_template_cache"] = production
+        tornado_settings["static_handler_class"] = (
+            StaticHandler if production else tornado.web.StaticFileHandler
+        )
+        super(Application, self).__init__(self.get_handlers(), **tornado_settings)
+
+    def get_handlers(self):
         handlers = [
             (r"%s/events" % self.base_url, PostHandler, {"app": self}),
             (r"%s/update" % self.base_url, UpdateHandler, {"app": self}),
@@ -112,9 +144,25 @@ class Application(tornado.web.Application):
             (r"%s/env_state" % self.base_url, EnvStateHandler, {"app": self}),
             (r"%s/fork_env" % self.base_url, ForkEnvHandler, {"app": self}),
             (r"%s/user/(.*)" % self.base_url, UserSettingsHandler, {"app": self}),
-            (r"%s(.*)" % self.base_url, IndexHandler, {"app": self}),
+            (r"%s/metrics" % self.base_url, MetricsHandler, {"app": self}),
+            (r"%s/debug/profile" % self.base_url, ProfileHandler, {"app": self}),
+            (r"%s/debug/stalls" % self.base_url, StallsHandler, {"app": self}),
+            (r"%s/blob" % self.base_url, BlobUploadHandler, {"app": self}),
         ]
-        super(Application, self).__init__(handlers, **tornado_settings)
+        if self.blob_store is not None:
+            handlers.append(
+                (
+                    r"%s/blob/(%s)" % (self.base_url, BLOB_NAME),
+                    BlobHandler,
+                    {"app": self},
+                )
+            )
+        handlers.append((r"%s(.*)" % self.base_url, IndexHandler, {"app": self}))
+        return handlers
+
+    def log_request(self, handler):
+        super().log_request(handler)
+        METRICS.observe_request(handler)
 
     def get_last_access(self):
         if len(self.subs) > 0 or len(self.sources) > 0:
@@ -161,17 +209,20 @@ class Application(tornado.web.Application):
                 "env_path=None.",
                 RuntimeWarning,
             )
+            if self.bus is not None and not self.bus.holds("main"):
+                return {}
             return {"main": {"jsons": {}, "reload": {}}}
         ensure_dir_exists(env_path)
         env_jsons = [i for i in os.listdir(env_path) if ".json" in i]
         for env_json in env_jsons:
             eid = env_json.replace(".json", "")
+            if self.bus is not None and not self.bus.holds(eid):
+                continue  # kept by another server process
             env_path_file = os.path.join(env_path, env_json)
 
             if self.eager_data_loading:
                 try:
-                    with open(env_path_file, "r") as fn:
-                        env_data = tornado.escape.json_decode(fn.read())
+                    env_data = read_env_file(env_path_file)
                 except Exception as e:
                     logging.warn(
                         "Failed loading environment json: {} - {}".format(
@@ -184,7 +235,11 @@ class Application(tornado.web.Application):
             else:
                 state[eid] = LazyEnvData(env_path_file)
 
-        if "main" not in state and "main.json" not in env_jsons:
+        if (
+            "main" not in state
+            and "main.json" not in env_jsons
+            and (self.bus is None or self.bus.holds("main"))
+        ):
             state["main"] = {"jsons": {}, "reload": {}}
             serialize_env(state, ["main"], env_path=self.env_path)
 
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Content-addressed store of the media (images, audio and videos) of the
+windows.
+
+The python client embeds media as base64 data URIs in the windows it sends.
+The server moves their bytes to files of `env_path/blobs`, named after the
+sha256 of the bytes, and has the windows reference them by `/blob/` url
+instead. Windows, env files and the messages of `load_env` then only hold
+the urls, and the browsers download each media once and cache it for good.
+The same media sent to several windows or envs is stored once.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+from visdom.utils.shared_utils import ensure_dir_exists
+
+# Extensions of the blobs by media type, aliases included, and back
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "audio/wav": "wav",
+    "audio/mp3": "mp3",
+    "audio/mpeg": "mp3",
+    "audio/ogg": "ogg",
+    "audio/flac": "flac",
+    "video/mp4": "mp4",
+    "video/webm": "webm",
+    "video/ogg": "ogv",
+    "video/avi": "avi",
+}
+MEDIA_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "gif": "image/gif",
+    "webp": "image/webp",
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",
+    "flac": "audio/flac",
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+    "ogv": "video/ogg",
+    "avi": "video/x-msvideo",
+}
+
+# Types of the window data that hold media, as sent by the python client
+MEDIA_DATA_TYPES = ("image", "image_history", "text")
+
+# Smaller media stay inline, an extra request would cost more
+MIN_BLOB_SIZE = 1024  # bytes of base64
+MAX_UPLOAD_SIZE = 4 * 1024**3  # bytes
+
+DATA_URI = re.compile(r"data:([a-z]+/[a-z0-9.+-]+);base64,([A-Za-z0-9+/=]+)")
+BLOB_NAME = r"[0-9a-f]{64}\.[a-z0-9]+"
+
+
+class BlobStore:
+    def __init__(self, env_path, base_url=""):
+        self.blob_dir = os.path.join(env_path, "blobs")
+        self.url_prefix = base_url + "/blob/"
+        ensure_dir_exists(self.blob_dir)
+
+    def path_of(self, name):
+        return os.path.join(self.blob_dir, name[:2], name)
+
+    def put(self, data, ext):
+        """Store bytes if they are not stored yet, returns the blob name"""
+        name = "{}.{}".format(hashlib.sha256(data).hexdigest(), ext)
+        if not os.path.isfile(self.path_of(name)):
+            upload = self.open_upload(ext)
+            upload.write(data)
+            upload.commit()
+        return name
+
+    def open_upload(self, ext):
+        """Start storing a blob received in chunks"""
+        return BlobUpload(self, ext)
+
+    def _store_data_uri(self, match):
+        ext = EXTENSIONS.get(match.group(1))
+        payload = match.group(2)
+        if ext is None or len(payload) < MIN_BLOB_SIZE:
+            return match.group(0)
+        try:
+            data = base64.b64decode(payload)
+        except (binascii.Error, ValueError):
+            return match.group(0)
+        return self.url_prefix + self.put(data, ext)
+
+    def store_uris(self, text):
+        """Replace the media data URIs of a string by blob urls"""
+        if "base64," not in text:
+            return text
+        return DATA_URI.sub(self._store_data_uri, text)
+
+    def store_media(self, args):
+        """
+        Move the media of the data of a window, or of an update to it, to the
+        store. The data is modified in place.
+        """
+        data = args.get("data")
+        if not isinstance(data, list):
+            return args
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            if item.get("type") not in MEDIA_DATA_TYPES:
+                continue
+            content = item.get("content")
+            if isinstance(content, str):
+                item["content"] = self.store_uris(content)
+            elif isinstance(content, dict) and isinstance(content.get("src"), str):
+                content["src"] = self.store_uris(content["src"])
+        return args
+
+
+class BlobUpload:
+    """
+    A blob being stored, written to a temporary file while it is received
+    and hashed, then renamed after its hash, as other processes may read it.
+    """
+
+    def __init__(self, store, ext):
+        self.store = store
+        self.ext = ext
+        self.hash = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.blob_dir, suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self.hash.update(chunk)
+        self.file.write(chunk)
+
+    def commit(self):
+        """Store the received blob, returns its name"""
+        self.file.close()
+        name = "{}.{}".format(self.hash.hexdigest(), self.ext)
+        path = self.store.path_of(name)
+        if os.path.isfile(path):
+            os.remove(self.tmp_path)  # stored already
+        else:
+            ensure_dir_exists(os.path.dirname(path))
+            os.replace(self.tmp_path, path)
+        self.tmp_path = None
+        return name
+
+    def discard(self):
+        if self.tmp_path is not None:
+            self.file.close()
+            os.remove(self.tmp_path)
+            self.tmp_path = None
@@ -6,13 +6,20 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import gzip
 import logging
 import os
 import visdom
 from urllib import request
 from urllib.error import HTTPError, URLError
+from visdom.server.defaults import COMPRESSED_EXTENSIONS, MIN_COMPRESSED_SIZE
 from visdom.utils.shared_utils import get_visdom_path
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 def download_scripts(proxies=None, install_dir=None):
     """
@@ -150,6 +157,47 @@ def download_scripts(proxies=None, install_dir=None):
             with open(os.path.join(extracted_directory, filename), "wb+") as file:
                 file.write(js_file.content)
 
+    compress_scripts(install_dir)
+
     if not is_built:
         with open(built_path, "w+") as build_file:
             build_file.write(visdom.__version__)
+
+
+def compress_scripts(install_dir=None):
+    """
+    Write precompressed variants next to the large static files (plotly,
+    main.js, ...), which the production server sends to the browsers that
+    accept them. Brotli variants are only written if brotli is installed.
+    """
+    if install_dir is None:
+        install_dir = get_visdom_path()
+
+    encoders = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoders[".br"] = lambda data: brotli.compress(data, quality=11)
+
+    for root, _, files in os.walk(os.path.join(install_dir, "static")):
+        for name in files:
+            path = os.path.join(root, name)
+            if not name.endswith(COMPRESSED_EXTENSIONS):
+                continue
+            if os.path.getsize(path) < MIN_COMPRESSED_SIZE:
+                continue
+            data = None
+            for ext, encode in encoders.items():
+                compressed_path = path + ext
+                if os.path.exists(compressed_path) and os.path.getmtime(
+                    compressed_path
+                ) >= os.path.getmtime(path):
+                    continue  # up to date
+                if data is None:
+                    with open(path, "rb") as fn:
+                        data = fn.read()
+                try:
+                    # replaced at once, as servers may be reading it
+                    with open(compressed_path + ".tmp", "wb") as fn:
+                        fn.write(encode(data))
+                    os.replace(compressed_path + ".tmp", compressed_path)
+                except OSError as exc:
+                    logging.error("Error {} while compressing {}".format(exc, path))
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Local message bus that keeps the worker processes of a multi-process server
+coherent.
+
+Every worker holds a replica of the full server state. Each environment is
+owned by exactly one worker (chosen by a stable hash of its eid), which is
+the only process that applies updates to it. Requests that modify an env are
+forwarded to its owner, and the owner publishes the resulting broadcasts on
+the bus. Every other worker applies them to its replica and relays them to
+its own subscribers.
+
+Workers are connected in a full mesh over unix domain sockets that live in a
+directory shared by all of the workers.
+"""
+
+import atexit
+import datetime
+import itertools
+import json
+import logging
+import os
+import socket
+import zlib
+
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.tcpserver
+import tornado.util
+import tornado.web
+from tornado.concurrent import Future
+
+from visdom.utils.server_utils import (
+    apply_broadcast,
+    broadcast,
+    broadcast_envs,
+    escape_eid,
+    send_to_sources,
+)
+
+MAX_MESSAGE_SIZE = 1024**3
+CONNECT_RETRY_DELAY = 0.1  # seconds
+REQUEST_TIMEOUT = 60  # seconds to wait for the response to a forwarded request
+
+
+def owner_of(eid, num_processes):
+    """Return the id of the worker that owns the given env"""
+    return zlib.crc32(eid.encode("utf-8")) % num_processes
+
+
+def forwarded_handlers():
+    """Handlers whose requests may be executed on behalf of another worker"""
+    from visdom.server.handlers import socket_handlers, web_handlers
+
+    handlers = [
+        web_handlers.PostHandler,
+        web_handlers.UpdateHandler,
+        web_handlers.CloseHandler,
+        web_handlers.DataHandler,
+        web_handlers.ExistsHandler,
+        web_handlers.DeleteEnvHandler,
+        web_handlers.ForkEnvHandler,
+        web_handlers.EnvHandler,
+        web_handlers.CompareHandler,
+        web_handlers.SaveHandler,
+    ]
+    handlers = {handler.__name__: handler for handler in handlers}
+    handlers["SocketWrap"] = socket_handlers.SocketWrap
+    handlers["VisSocketWrap"] = socket_handlers.VisSocketWrap
+    return handlers
+
+
+def apply_change(app, msg):
+    """
+    Apply a change published by the process that owns an env to the replica
+    held by this process, and pass it on to the clients of this process.
+    """
+    kind = msg["kind"]
+    if kind == "broadcast":
+        apply_broadcast(app.state, msg["msg"], msg["eid"])
+        broadcast(app, msg["msg"], msg["eid"], relay=False)
+    elif kind == "broadcast_envs":
+        broadcast_envs(app, relay=False)
+    elif kind == "sources":
+        send_to_sources(app, msg["msg"], relay=False)
+    elif kind == "env":
+        if msg["env"] is None:
+            app.state.pop(msg["eid"], None)
+        elif not msg.get("create_only") or msg["eid"] not in app.state:
+            app.state[msg["eid"]] = msg["env"]
+    elif kind == "layouts":
+        app.layouts = msg["data"]
+        for sub in app.subs.values():
+            sub.write_message(
+                json.dumps({"command": "layout_update", "data": app.layouts})
+            )
+
+
+class ForwardedHandler:
+    """
+    Stands in for a request or socket handler when a worker executes a
+    request that was forwarded to it by another worker. Anything written to
+    it is collected and sent back as the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.application = app
+        self.state = app.state
+        self.subs = app.subs
+        self.sources = app.sources
+        self.port = app.port
+        self.env_path = app.env_path
+        self.login_enabled = app.login_enabled
+        self.readonly = app.readonly
+        self.eid = "main"
+        self.output = []
+        self.status = 200
+
+    def set_status(self, status_code, reason=None):
+        self.status = status_code
+
+    def write(self, chunk):
+        if isinstance(chunk, dict):
+            chunk = json.dumps(chunk)
+        self.output.append(chunk)
+
+    def get_output(self):
+        return "".join(self.output)
+
+
+class _BusServer(tornado.tcpserver.TCPServer):
+    def __init__(self, bus):
+        super().__init__(max_buffer_size=MAX_MESSAGE_SIZE)
+        self.bus = bus
+
+    async def handle_stream(self, stream, address):
+        while True:
+            try:
+                line = await stream.read_until(b"\n")
+            except tornado.iostream.StreamClosedError:
+                return
+            try:
+                self.bus.on_message(json.loads(line))
+            except Exception:
+                logging.exception("Failed to handle message from the worker bus")
+
+
+class ProcessBus:
+    """
+    Connects one worker of a multi-process server to all of its peers.
+    """
+
+    def __init__(self, bus_dir, task_id, num_processes):
+        self.bus_dir = bus_dir
+        self.task_id = task_id
+        self.num_processes = num_processes
+        self.app = None
+        self.peers = {}
+        self.peer_ids = self.get_peer_ids()
+        self.pending = {
+            i: [] for i in self.peer_ids
+        }  # messages queued until the connection to a peer is up
+        self.responses = {}
+        self.request_ids = itertools.count()
+
+    def get_peer_ids(self):
+        return [i for i in range(self.num_processes) if i != self.task_id]
+
+    def socket_path(self, task_id):
+        return os.path.join(self.bus_dir, "worker_{}.sock".format(task_id))
+
+    def start(self, app):
+        """Listen for peers and connect to all of them"""
+        self.app = app
+        server = _BusServer(self)
+        server.add_socket(
+            tornado.netutil.bind_unix_socket(self.socket_path(self.task_id))
+        )
+        for peer_id in self.pending:
+            tornado.ioloop.IOLoop.current().spawn_callback(self._connect, peer_id)
+        atexit.register(self.close)
+
+    def close(self):
+        """
+        Remove the socket of this worker, and the directory of the bus once
+        the last worker is gone
+        """
+        try:
+            os.remove(self.socket_path(self.task_id))
+            os.rmdir(self.bus_dir)
+        except OSError:
+            pass  # removed already, or other workers are still running
+
+    async def _connect(self, peer_id):
+        path = self.socket_path(peer_id)
+        while True:
+            stream = tornado.iostream.IOStream(
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM),
+                max_buffer_size=MAX_MESSAGE_SIZE,
+            )
+            try:
+                await stream.connect(path)
+                break
+            except (tornado.iostream.StreamClosedError, OSError):
+                await tornado.gen.sleep(CONNECT_RETRY_DELAY)
+        self.peers[peer_id] = stream
+        for data in self.pending.pop(peer_id, []):
+            stream.write(data)
+        logging.info("Worker {} connected to worker {}".format(self.task_id, peer_id))
+        self.on_connect(peer_id)
+
+    def on_connect(self, peer_id):
+        pass
+
+    # ---- ownership ---- #
+
+    def owner_of(self, eid):
+        return owner_of(eid, self.num_processes)
+
+    def owns(self, eid):
+        return self.owner_of(eid) == self.task_id
+
+    def holds(self, eid):
+        """Whether this worker keeps a copy of the given env"""
+        return True
+
+    def tag_sid(self, sid):
+        """Prefix a socket id with this worker's id so peers can route to it"""
+        return "{}_{}".format(self.task_id, sid)
+
+    def worker_of_sid(self, sid):
+        sid = str(sid)
+        if "_" not in sid:
+            return self.task_id
+        return int(sid.split("_", 1)[0])
+
+    # ---- sending ---- #
+
+    def _send(self, peer_id, msg):
+        data = json.dumps(msg).encode("utf-8") + b"\n"
+        self._write(peer_id, data)
+
+    def _write(self, peer_id, data):
+        if peer_id in self.peers:
+            try:
+                self.peers[peer_id].write(data)
+            except tornado.iostream.StreamClosedError:
+                logging.error("Lost connection to worker {}".format(peer_id))
+        else:
+            self.pending[peer_id].append(data)
+
+    def publish(self, kind, **payload):
+        """Send a message to every other worker"""
+        payload["kind"] = kind
+        payload["origin"] = self.task_id
+        # serialize once and write the same bytes to every peer
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        for peer_id in self.peer_ids:
+            self._write(peer_id, data)
+
+    async def call(self, peer_id, handler, args):
+        """
+        Execute `handler.wrap_func` on another worker, returning everything
+        the handler wrote. Raises an HTTPError with the status of the request
+        if it failed on that worker, or 504 if the worker did not respond
+        within REQUEST_TIMEOUT seconds.
+        """
+        request_id = next(self.request_ids)
+        future = Future()
+        self.responses[request_id] = future
+        self._send(
+            peer_id,
+            {
+                "kind": "request",
+                "id": request_id,
+                "origin": self.task_id,
+                "handler": handler,
+                "args": args,
+            },
+        )
+        try:
+            response = await tornado.gen.with_timeout(
+                datetime.timedelta(seconds=REQUEST_TIMEOUT), future
+            )
+        except tornado.util.TimeoutError:
+            self.responses.pop(request_id, None)
+            raise tornado.web.HTTPError(
+                504, "Worker {} did not respond to {}".format(peer_id, handler)
+            )
+        status = response.get("status", 200)
+        if status >= 400:
+            raise tornado.web.HTTPError(
+                status, "{} failed on worker {}".format(handler, peer_id)
+            )
+        return response["output"]
+
+    def forward_socket_command(self, peer_id, message):
+        self._send(peer_id, {"kind": "socket_command", "message": message})
+
+    def route_socket_command(self, socket, msg, message):
+        """
+        Forward a socket command to the worker that owns the env it applies
+        to. Returns False if the command should be handled by this process.
+        """
+        eid = msg.get("eid")
+        if msg["cmd"] in ["pop_embeddings_pane", "forward_to_vis"]:
+            eid = msg["data"]["eid"]
+        if eid is None:
+            return False
+        eid = escape_eid(eid)
+        if self.owns(eid):
+            return False
+        self.forward_socket_command(self.owner_of(eid), message)
+        if msg["cmd"] == "save":
+            socket.eid = eid
+        return True
+
+    # ---- receiving ---- #
+
+    def on_message(self, msg):
+        kind = msg["kind"]
+        if kind == "request":
+            self._handle_request(msg)
+        elif kind == "response":
+            future = self.responses.pop(msg["id"], None)
+            if future is not None:
+                future.set_result(msg)
+        elif kind == "socket_command":
+            from visdom.server.handlers.socket_handlers import AnySocketHandlerOrWrapper
+
+            AnySocketHandlerOrWrapper.on_message(
+                ForwardedHandler(self.app), msg["message"]
+            )
+        else:
+            apply_change(self.app, msg)
+
+    def handlers(self):
+        return forwarded_handlers()
+
+    def _handle_request(self, msg):
+        tornado.ioloop.IOLoop.current().spawn_callback(self._run_request, msg)
+
+    async def _run_request(self, msg):
+        handler = ForwardedHandler(self.app)
+        try:
+            result = self.handlers()[msg["handler"]].wrap_func(handler, msg["args"])
+            if result is not None:
+                await result
+        except Exception:
+            logging.exception("Forwarded {} request failed".format(msg["handler"]))
+            handler.set_status(500)
+        self._send(
+            msg["origin"],
+            {
+                "kind": "response",
+                "id": msg["id"],
+                "output": handler.get_output(),
+                "status": handler.status,
+            },
+        )
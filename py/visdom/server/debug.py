@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Tools to find out what a running server spends its time on, without having
+to attach a debugger to it.
+"""
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+import tornado.ioloop
+import tornado.web
+
+SAMPLE_INTERVAL = 0.005  # seconds
+MAX_PROFILE_SECONDS = 60
+TOP_FUNCTIONS = 30
+STALL_HISTORY = 100  # stalls kept for /debug/stalls
+
+
+def frame_name(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    # keep the part of the path that tells the modules apart
+    parts = filename.split(os.sep)
+    if "site-packages" in parts:
+        parts = parts[parts.index("site-packages") + 1 :]
+    elif "visdom" in parts:
+        parts = parts[parts.index("visdom") :]
+    else:
+        parts = parts[-2:]
+    return "{} ({}:{})".format(code.co_name, "/".join(parts), code.co_firstlineno)
+
+
+class StackSampler:
+    """
+    Samples the stack of a thread at a fixed interval from another thread,
+    to profile it while it keeps running.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.num_samples = 0
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        if stack:
+            self.stacks[tuple(reversed(stack))] += 1
+            self.num_samples += 1
+
+    def run(self, seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            self.sample()
+            time.sleep(self.interval)
+        return self
+
+    def collapsed(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope"""
+        return "".join(
+            "{} {}\n".format(";".join(stack), count)
+            for stack, count in self.stacks.most_common()
+        )
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """Functions by the samples spent in them (self) or under them (total)"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+        return [
+            (name, own[name], total[name])
+            for name, _ in sorted(
+                total.items(), key=lambda item: (own[item[0]], item[1]), reverse=True
+            )[:limit]
+        ]
+
+    def summary(self):
+        lines = [
+            "{} samples of thread {} every {:g}s".format(
+                self.num_samples, self.thread_id, self.interval
+            ),
+            "",
+            "{:>7} {:>7}  function".format("self%", "total%"),
+        ]
+        num_samples = max(self.num_samples, 1)
+        for name, own, total in self.top_functions():
+            lines.append(
+                "{:>7.1f} {:>7.1f}  {}".format(
+                    100.0 * own / num_samples, 100.0 * total / num_samples, name
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+_profile_lock = threading.Lock()
+
+
+def profile_thread(thread_id, seconds, interval=SAMPLE_INTERVAL):
+    """
+    Sample a thread for the given time, to be run outside of that thread.
+    Returns None if another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return StackSampler(thread_id, interval).run(seconds)
+    finally:
+        _profile_lock.release()
+
+
+def stall_context(frame):
+    """
+    Find out what the IOLoop is busy with from its stack: the handler
+    running, its request, and the env and window it works on.
+    """
+    from visdom.server.bus import ForwardedHandler
+
+    context = {
+        "handler": None,
+        "endpoint": None,
+        "eid": None,
+        "win": None,
+        "payload_size": None,
+    }
+    body = None
+    while frame is not None:
+        local_vars = frame.f_locals
+        for name in ("args", "req", "msg", "data"):
+            value = local_vars.get(name)
+            if isinstance(value, dict):
+                if context["eid"] is None and isinstance(value.get("eid"), str):
+                    context["eid"] = value["eid"]
+                if context["win"] is None and isinstance(value.get("win"), str):
+                    context["win"] = value["win"]
+        if context["eid"] is None and isinstance(local_vars.get("eid"), str):
+            context["eid"] = local_vars["eid"]
+        for name in ("win", "wid"):
+            if context["win"] is None and isinstance(local_vars.get(name), str):
+                context["win"] = local_vars[name]
+
+        handler = local_vars.get("self")
+        if context["handler"] is None and isinstance(
+            handler, (tornado.web.RequestHandler, ForwardedHandler)
+        ):
+            context["handler"] = type(handler).__name__
+            message = local_vars.get("message")
+            if isinstance(message, (str, bytes)):
+                context["payload_size"] = len(message)  # socket message
+            request = getattr(handler, "request", None)
+            if request is not None:
+                context["endpoint"] = "{} {}".format(request.method, request.path)
+                body = request.body or b""
+                if context["payload_size"] is None:
+                    context["payload_size"] = len(body)
+        frame = frame.f_back
+
+    # the request may not have been decoded yet
+    for key in ("eid", "win"):
+        if context[key] is None and body:
+            match = re.search(b'"' + key.encode() + b'": *"([^"]*)"', body)
+            if match is not None:
+                context[key] = match.group(1).decode("utf-8", "replace")
+    return context
+
+
+class StallDetector:
+    """
+    Watchdog reporting the callbacks that block the IOLoop for longer than
+    a threshold. The IOLoop records a heartbeat at a fixed interval, and a
+    watchdog thread samples the stack of the IOLoop thread when the
+    heartbeat is late. The last stalls are kept in a ring buffer.
+    """
+
+    def __init__(self, threshold, history=STALL_HISTORY):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.stalls = deque(maxlen=history)
+        self.last_tick = time.monotonic()
+        self.thread_id = None
+
+    def start(self):
+        """Start watching the IOLoop of the current thread"""
+        self.thread_id = threading.get_ident()
+        tornado.ioloop.PeriodicCallback(self.tick, self.interval * 1000).start()
+        threading.Thread(
+            target=self.watch, name="visdom-stall-detector", daemon=True
+        ).start()
+
+    def tick(self):
+        self.last_tick = time.monotonic()
+
+    def watch(self):
+        stall = None
+        stall_tick = None
+        while True:
+            time.sleep(self.interval)
+            last_tick = self.last_tick
+            if stall is not None:
+                if last_tick == stall_tick:
+                    continue  # still blocked
+                stall["duration"] = round(last_tick - stall_tick - self.interval, 4)
+                self.report(stall)
+                stall = None
+            if time.monotonic() - last_tick > self.interval + self.threshold:
+                stall = self.sample()
+                stall_tick = last_tick
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stall = {"time": time.time(), "duration": None}
+        stall.update(stall_context(frame))
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        stall["stack"] = list(reversed(stack))
+        return stall
+
+    def report(self, stall):
+        self.stalls.append(stall)
+        logging.warning(
+            "IOLoop blocked for {}s by {} ({}), eid={} win={} payload={} bytes, "
+            "at:\n  {}".format(
+                stall["duration"],
+                stall["handler"],
+                stall["endpoint"],
+                stall["eid"],
+                stall["win"],
+                stall["payload_size"],
+                "\n  ".join(stall["stack"][-15:]),
+            )
+        )
@@ -9,8 +9,14 @@
 from os.path import expanduser
 
 LAYOUT_FILE = "layouts.json"
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_GRACE_PERIOD = 60  # seconds before an unused snapshot can be removed
 DEFAULT_ENV_PATH = "%s/.visdom/" % expanduser("~")
 DEFAULT_PORT = 8097
 DEFAULT_HOSTNAME = "localhost"
 DEFAULT_BASE_URL = "/"
 MAX_SOCKET_WAIT = 15
+MAX_LONG_POLL_WAIT = 10
+COMPRESSED_EXTENSIONS = (".js", ".css", ".svg")
+MIN_COMPRESSED_SIZE = 10 * 1024  # bytes, smaller files are served as they are
+PREVIEW_CACHE_SIZE = 4096  # hover previews of the embeddings windows
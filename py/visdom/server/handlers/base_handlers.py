@@ -57,6 +57,23 @@ class BaseHandler(tornado.web.RequestHandler):
         except Exception:  # Not using secure cookies
             return None
 
+    async def forward_request(self, args, eid=None, sid=None, name=None):
+        """
+        When the server runs as several worker processes, execute this
+        request on the worker that owns env `eid` (or holds socket `sid`)
+        and write its response. Returns False if the request should be
+        handled by this process.
+        """
+        bus = getattr(self.application, "bus", None)
+        if bus is None:
+            return False
+        worker = bus.owner_of(eid) if sid is None else bus.worker_of_sid(sid)
+        if worker == bus.task_id:
+            return False
+        name = type(self).__name__ if name is None else name
+        self.write(await bus.call(worker, name, args))
+        return True
+
     def write_error(self, status_code, **kwargs):
         logging.error("ERROR: %s: %s" % (status_code, kwargs))
         if "exc_info" in kwargs:
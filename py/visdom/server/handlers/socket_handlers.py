@@ -13,7 +13,7 @@ necessary, but defers underlying manipulations of the server's data to
 the data_model itself.
 """
 
-import copy
+import datetime
 import json
 import logging
 import os
@@ -22,17 +22,36 @@ import types
 
 import tornado.ioloop
 import tornado.escape
+import tornado.locks
+import tornado.util
 from visdom.server.handlers.base_handlers import BaseWebSocketHandler, BaseHandler
 from visdom.utils.shared_utils import get_rand_id
 from visdom.utils.server_utils import (
     check_auth,
     broadcast_envs,
+    collect_snapshots,
     serialize_env,
     send_to_sources,
     broadcast,
     escape_eid,
+    fork_env,
+    own_window,
+    pop_embeddings_layer,
+    relay_env,
+    relay_to_workers,
 )
-from visdom.server.defaults import MAX_SOCKET_WAIT
+from visdom.server.defaults import MAX_SOCKET_WAIT, MAX_LONG_POLL_WAIT
+
+# Socket commands that act on an env, and are thus handled by the process
+# that owns the env when running with several processes
+OWNER_COMMANDS = [
+    "close",
+    "save",
+    "delete_env",
+    "forward_to_vis",
+    "layout_item_update",
+    "pop_embeddings_pane",
+]
 
 
 # TODO move the logic that actually parses environments and layouts to
@@ -79,6 +98,8 @@ class AnySocketHandlerOrWrapper(BaseWebSocketHandler):
     def open(self, register_to="sources"):
         # self.sid = str(hex(int(time.time() * 10000000))[2:]) # TODO: was previously used for websockets+vis only
         self.sid = get_rand_id()
+        if self.app.bus is not None:
+            self.sid = self.app.bus.tag_sid(self.sid)
         register_list = self.sources if register_to == "sources" else self.subs
         if self not in list(register_list.values()):
             self.eid = "main"
@@ -95,7 +116,11 @@ class AnySocketHandlerOrWrapper(BaseWebSocketHandler):
         if self.readonly:
             return
 
-        elif cmd == "close":
+        if self.app.bus is not None and cmd in OWNER_COMMANDS:
+            if self.app.bus.route_socket_command(self, msg, message):
+                return
+
+        if cmd == "close":
             if "data" in msg and "eid" in msg:
                 logging.info(f"closing window {msg['data']}")
                 p_data = self.state[msg["eid"]]["jsons"].pop(msg["data"], None)
@@ -105,16 +130,21 @@ class AnySocketHandlerOrWrapper(BaseWebSocketHandler):
                     "eid": msg["eid"],
                     "pane_data": p_data,
                 }
+                relay_env(self, msg["eid"])
                 send_to_sources(self, event)
 
         elif cmd == "save":
             # save localStorage window metadata
             if "data" in msg and "eid" in msg:
                 msg["eid"] = escape_eid(msg["eid"])
-                self.state[msg["eid"]] = copy.deepcopy(self.state[msg["prev_eid"]])
+                fork_env(
+                    self.state, msg["prev_eid"], msg["eid"], env_path=self.env_path
+                )
                 self.state[msg["eid"]]["reload"] = msg["data"]
                 self.eid = msg["eid"]
                 serialize_env(self.state, [self.eid], env_path=self.env_path)
+                collect_snapshots(self.env_path)
+                relay_env(self, self.eid)
 
         elif cmd == "delete_env":
             if "eid" in msg:
@@ -123,17 +153,51 @@ class AnySocketHandlerOrWrapper(BaseWebSocketHandler):
                 if self.env_path is not None:
                     p = os.path.join(self.env_path, "{0}.json".format(msg["eid"]))
                     os.remove(p)
+                    collect_snapshots(self.env_path)
+                relay_env(self, msg["eid"])
                 broadcast_envs(self)
 
         elif cmd == "save_layouts":
             if "data" in msg:
                 self.app.layouts = msg.get("data")
                 self.app.save_layouts()
+                relay_to_workers(self, "layouts", data=self.app.layouts)
                 self.broadcast_layouts()
 
         elif cmd == "forward_to_vis":
             packet = msg.get("data")
             environment = self.state[packet["eid"]]
+            if packet.get("event_type") == "EntitySelected":
+                # previews of entities hovered before, or prefetched, are sent
+                # without asking the python client again
+                p = environment["jsons"].get(packet["target"])
+                preview = None
+                if p is not None and p.get("type") == "embeddings":
+                    preview = self.app.previews.get(p, packet.get("idx"))
+                if preview is not None:
+                    # the preview is transient, a window shared with a fork
+                    # is left as it is rather than copied
+                    content_id = get_rand_id()
+                    if p["id"] not in getattr(environment["jsons"], "shared", ()):
+                        p["content"]["selected"] = preview
+                        p["contentID"] = content_id
+                    patch = [
+                        {
+                            "op": "add",
+                            "path": "/content/selected",
+                            "value": preview,
+                        },
+                        {"op": "replace", "path": "/contentID", "value": content_id},
+                    ]
+                    broadcast_packet = {
+                        "command": "window_update",
+                        "win": p["id"],
+                        "env": packet["eid"],
+                        "content": patch,
+                        "version": p.get("version", 1),
+                    }
+                    broadcast(self, broadcast_packet, packet["eid"])
+                    return
             if packet.get("pane_data") is not False:
                 packet["pane_data"] = environment["jsons"][packet["target"]]
             send_to_sources(self, msg.get("data"))
@@ -142,14 +206,15 @@ class AnySocketHandlerOrWrapper(BaseWebSocketHandler):
             eid = msg.get("eid")
             win = msg.get("win")
             self.state[eid]["reload"][win] = msg.get("data")
+            relay_env(self, eid)
 
         elif cmd == "pop_embeddings_pane":
             packet = msg.get("data")
             eid = packet["eid"]
             win = packet["target"]
-            p = self.state[eid]["jsons"][win]
+            p = own_window(self.state[eid], win)
             p["content"]["selected"] = None
-            p["content"]["data"] = p["old_content"].pop()
+            p["content"]["data"] = pop_embeddings_layer(p)
             if len(p["old_content"]) == 0:
                 p["content"]["has_previous"] = False
             p["contentID"] = get_rand_id()
@@ -165,6 +230,8 @@ class AnySocketWrapper(AnySocketHandlerOrWrapper):
         super().initialize(app)
 
         self.messages = []
+        self.message_event = tornado.locks.Event()
+        self.parked_requests = 0
         self.last_read_time = time.time()
         self.open()
         try:
@@ -178,26 +245,45 @@ class AnySocketWrapper(AnySocketHandlerOrWrapper):
 
     def socket_wrap_monitor_thread(self):
         if len(self.subs) > 0 or len(self.sources) > 0:
-            for sub in list(self.subs.values()):
-                if (
-                    hasattr(sub, "last_read_time")
-                    and time.time() - sub.last_read_time > MAX_SOCKET_WAIT
-                ):
-                    sub.close()
-            for sub in list(self.sources.values()):
-                if (
-                    hasattr(sub, "last_read_time")
-                    and time.time() - sub.last_read_time > MAX_SOCKET_WAIT
-                ):
+            for sub in list(self.subs.values()) + list(self.sources.values()):
+                if isinstance(sub, AnySocketWrapper) and sub.is_idle():
                     sub.close()
         else:
             self.app.socket_wrap_monitor.stop()
 
+    def is_idle(self):
+        # A wrapper with a parked long-poll request is still being read from
+        if self.parked_requests > 0:
+            return False
+        return time.time() - self.last_read_time > MAX_SOCKET_WAIT
+
     def close(self):
         self.on_close()
+        # wake up any parked request so it can report the closure
+        self.message_event.set()
 
     def write_message(self, msg):
         self.messages.append(msg)
+        self.message_event.set()
+
+    async def wait_for_messages(self, timeout):
+        """
+        Park the calling request until a message is available, the wrapper
+        is closed or `timeout` seconds have passed.
+        """
+        if len(self.messages) > 0 or timeout <= 0:
+            return
+        self.message_event.clear()
+        self.parked_requests += 1
+        try:
+            await self.message_event.wait(
+                timeout=datetime.timedelta(seconds=min(timeout, MAX_LONG_POLL_WAIT))
+            )
+        except tornado.util.TimeoutError:
+            pass
+        finally:
+            self.parked_requests -= 1
+            self.last_read_time = time.time()
 
     def get_messages(self):
         to_send = []
@@ -208,6 +294,7 @@ class AnySocketWrapper(AnySocketHandlerOrWrapper):
                 # TODO investigate
                 message = json.dumps(message)
             to_send.append(message)
+        self.message_event.clear()
         self.last_read_time = time.time()
         return to_send
 
@@ -317,43 +404,62 @@ def WrapSocketWrapper(BaseWrapper):
             self.login_enabled = app.login_enabled
             self.app = app
 
-        def post(self):
-            """Either write a message to the socket, or query what's there"""
-            # TODO formalize failure reasons
-            args = tornado.escape.json_decode(
-                tornado.escape.to_basestring(self.request.body)
-            )
+        @staticmethod
+        async def wrap_func(handler, args):
             msg_type = args.get("message_type")
             sid = args.get("sid")
-
-            if BaseWrapper == VisSocketWrapper and sid is None:
-                new_sub = VisSocketWrapper()
-                new_sub.initialize(self.app)
-                self.write(json.dumps({"success": True, "sid": new_sub.sid}))
-                return
-
             socket_wrap = (
-                self.subs if BaseWrapper == SocketWrapper else self.sources
+                handler.subs if BaseWrapper == SocketWrapper else handler.sources
             ).get(sid)
 
             # ensure a wrapper still exists for this connection
             if socket_wrap is None:
-                self.write(json.dumps({"success": False, "reason": "closed"}))
+                handler.write(json.dumps({"success": False, "reason": "closed"}))
                 return
 
             # handle the requests
             if msg_type == "query":
+                await socket_wrap.wait_for_messages(args.get("timeout", 0))
+                if socket_wrap.sid not in (
+                    handler.subs if BaseWrapper == SocketWrapper else handler.sources
+                ):
+                    handler.write(json.dumps({"success": False, "reason": "closed"}))
+                    return
                 messages = socket_wrap.get_messages()
-                self.write(json.dumps({"success": True, "messages": messages}))
+                handler.write(json.dumps({"success": True, "messages": messages}))
             elif msg_type == "send":
                 msg = args.get("message")
                 if msg is None:
-                    self.write(json.dumps({"success": False, "reason": "no msg"}))
+                    handler.write(json.dumps({"success": False, "reason": "no msg"}))
                 else:
                     socket_wrap.on_message(msg)
-                    self.write(json.dumps({"success": True}))
+                    handler.write(json.dumps({"success": True}))
             else:
-                self.write(json.dumps({"success": False, "reason": "invalid"}))
+                handler.write(json.dumps({"success": False, "reason": "invalid"}))
+
+        async def post(self):
+            """
+            Either write a message to the socket, or query what's there. A
+            query with a positive `timeout` (in seconds) is held open until
+            messages are available or the timeout passes.
+            """
+            # TODO formalize failure reasons
+            args = tornado.escape.json_decode(
+                tornado.escape.to_basestring(self.request.body)
+            )
+            sid = args.get("sid")
+
+            if BaseWrapper == VisSocketWrapper and sid is None:
+                new_sub = VisSocketWrapper()
+                new_sub.request = self.request
+                new_sub.initialize(self.app)
+                self.write(json.dumps({"success": True, "sid": new_sub.sid}))
+                return
+
+            name = "SocketWrap" if BaseWrapper == SocketWrapper else "VisSocketWrap"
+            if await self.forward_request(args, sid=sid, name=name):
+                return
+            await self.wrap_func(self, args)
 
     if BaseWrapper == SocketWrapper:
 
@@ -19,7 +19,9 @@ import json
 import jsonpatch
 import logging
 import math
+import mimetypes
 import os
+import threading
 from collections import OrderedDict
 
 try:
@@ -30,6 +32,8 @@ except ImportError:
     from collections import Mapping, Sequence
 
 import tornado.escape
+import tornado.ioloop
+import tornado.web
 from visdom.utils.shared_utils import get_rand_id
 from visdom.utils.server_utils import (
     check_auth,
@@ -38,16 +42,24 @@ from visdom.utils.server_utils import (
     register_window,
     gather_envs,
     broadcast_envs,
+    collect_snapshots,
     serialize_env,
     escape_eid,
     compare_envs,
+    fork_env,
     load_env,
+    own_window,
+    push_embeddings_layer,
     broadcast,
     update_window,
     hash_password,
     stringify,
+    relay_env,
 )
 from visdom.server.handlers.base_handlers import BaseHandler
+from visdom.server.blobs import EXTENSIONS, MAX_UPLOAD_SIZE, MEDIA_TYPES
+from visdom.server.debug import MAX_PROFILE_SECONDS, profile_thread
+from visdom.server.metrics import collect, exposition
 
 
 # TODO move the logic that actually parses environments and layouts to
@@ -64,13 +76,10 @@ class PostHandler(BaseHandler):
         self.port = app.port
         self.env_path = app.env_path
         self.login_enabled = app.login_enabled
+        self.blob_store = app.blob_store
 
-    @check_auth
-    def post(self):
-        req = tornado.escape.json_decode(
-            tornado.escape.to_basestring(self.request.body)
-        )
-
+    @staticmethod
+    def wrap_func(handler, req):
         if req.get("func") is not None:
             raise Exception(
                 "Support for Lua Torch was deprecated following `v0.1.8.4`. "
@@ -82,7 +91,18 @@ class PostHandler(BaseHandler):
         eid = extract_eid(req)
         p = window(req)
 
-        register_window(self, p, eid)
+        register_window(handler, p, eid)
+
+    @check_auth
+    async def post(self):
+        req = tornado.escape.json_decode(
+            tornado.escape.to_basestring(self.request.body)
+        )
+        if self.blob_store is not None:
+            self.blob_store.store_media(req)
+        if await self.forward_request(req, eid=extract_eid(req)):
+            return
+        self.wrap_func(self, req)
 
 
 class ExistsHandler(BaseHandler):
@@ -103,24 +123,33 @@ class ExistsHandler(BaseHandler):
             handler.write("false")
 
     @check_auth
-    def post(self):
+    async def post(self):
         args = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )
+        if await self.forward_request(args, eid=extract_eid(args)):
+            return
         self.wrap_func(self, args)
 
 
 class UpdateHandler(BaseHandler):
     def initialize(self, app):
+        self.app = app
         self.state = app.state
         self.subs = app.subs
         self.sources = app.sources
         self.port = app.port
         self.env_path = app.env_path
         self.login_enabled = app.login_enabled
+        self.blob_store = app.blob_store
 
     @staticmethod
     def update_packet(p, args):
+        if p["type"] == "image_history":
+            return UpdateHandler.update_history_packet(p, args)
+        trace = UpdateHandler.heatmap_trace(p, args)
+        if trace is not None:
+            return UpdateHandler.update_heatmap_packet(p, args, trace)
         old_p = copy.deepcopy(p)
         p = UpdateHandler.update(p, args)
         p["contentID"] = get_rand_id()
@@ -129,6 +158,94 @@ class UpdateHandler(BaseHandler):
         patch = jsonpatch.make_patch(old_p, p)
         return p, patch.patch
 
+    @staticmethod
+    def update_history_packet(p, args):
+        """
+        Update an image_history window, building its patch directly, as deep
+        copying and diffing the whole history would grow with its length
+        """
+        num_frames = len(p["content"])
+        p = UpdateHandler.update(p, args)
+        p["contentID"] = get_rand_id()
+        appended = args["data"][0]["type"] == "image_history"
+        dropped = num_frames + int(appended) - len(p["content"])
+        patch = [{"op": "remove", "path": "/content/0"}] * dropped
+        if appended:
+            patch.append({"op": "add", "path": "/content/-", "value": p["content"][-1]})
+        patch.append({"op": "replace", "path": "/selected", "value": p["selected"]})
+        patch.append({"op": "replace", "path": "/contentID", "value": p["contentID"]})
+        return p, patch
+
+    @staticmethod
+    def heatmap_trace(p, args):
+        """Index of the heatmap trace that an update grows or replaces, if any"""
+        if p["type"] != "plot" or not args.get("data") or args.get("delete"):
+            return None
+        if args.get("updateDir") is None:
+            return None
+        pdata = p["content"]["data"]
+        name = args.get("name")
+        idxs = [
+            i for i in range(len(pdata)) if name is None or pdata[i]["name"] == name
+        ]
+        if len(idxs) != 1 or pdata[idxs[0]]["type"] != "heatmap":
+            return None
+        return idxs[0]
+
+    @staticmethod
+    def update_heatmap_packet(p, args, trace):
+        """
+        Update a heatmap, building the patch of its values and labels
+        directly, as deep copying and diffing the whole matrix would grow
+        with its size. The rest of the window is diffed.
+
+        Appends take amortized O(1) per value. Prepends insert at the front of
+        the lists, which shifts the rows, or every row for a column: O(rows)
+        for a row, and O(rows * columns) for a column.
+        """
+        plot = p["content"]["data"][trace]
+        grown = {k: plot[k] for k in ("z", "x", "y") if plot.get(k) is not None}
+        num_rows = len(plot["z"])
+        num_columns = len(plot["z"][0]) if num_rows > 0 else 0
+        old_lengths = {k: len(v) for k, v in grown.items()}
+        # the values and labels are left out of the copy and of the diff
+        old_p = copy.deepcopy(p, {id(v): None for v in grown.values()})
+        p = UpdateHandler.update(p, args)
+        p["contentID"] = get_rand_id()
+        values = {k: plot[k] for k in ("z", "x", "y")}
+        for k in values:
+            plot[k] = None
+        patch = jsonpatch.make_patch(old_p, p).patch
+        plot.update(values)
+
+        def added(path, new, old_length, at_end):
+            num_added = len(new) - old_length
+            if at_end:
+                return [
+                    {"op": "add", "path": path + "/-", "value": v}
+                    for v in new[old_length:]
+                ]
+            return [
+                {"op": "add", "path": "{}/{}".format(path, i), "value": new[i]}
+                for i in range(num_added)
+            ]
+
+        path = "/content/data/{}/".format(trace)
+        direction = args["updateDir"]
+        at_end = direction.startswith("append")
+        for k, v in values.items():
+            if v is None:
+                if k in grown:
+                    patch.append({"op": "add", "path": path + k, "value": None})
+            elif grown.get(k) is not v or direction == "replace":
+                patch.append({"op": "add", "path": path + k, "value": v})
+            elif k == "z" and direction.endswith("Column"):
+                for i, row in enumerate(v):
+                    patch += added(path + "z/{}".format(i), row, num_columns, at_end)
+            else:
+                patch += added(path + k, v, old_lengths[k], at_end)
+        return p, patch
+
     @staticmethod
     def update(p, args):
         # Update text in window, separated by a line break
@@ -143,16 +260,21 @@ class UpdateHandler(BaseHandler):
                 p["content"]["selected"] = args["data"]["selected"]
             elif args["data"]["update_type"] == "RegionSelected":
                 p["content"]["selected"] = None
-                print(len(p["content"]["data"]))
-                p["old_content"].append(p["content"]["data"])
+                push_embeddings_layer(p)
                 p["content"]["has_previous"] = True
                 p["content"]["data"] = args["data"]["points"]
-                print(len(p["content"]["data"]))
+                p["content"]["progress"] = None
+            elif args["data"]["update_type"] == "Progress":
+                p["content"]["progress"] = args["data"]["progress"]
             return p
         if p["type"] == "image_history":
             utype = args["data"][0]["type"]
             if utype == "image_history":
                 p["content"].append(args["data"][0]["content"])
+                # only the last frames are kept, if the window has a limit
+                history_size = p.get("history_size")
+                if history_size is not None and len(p["content"]) > history_size:
+                    del p["content"][: len(p["content"]) - max(history_size, 1)]
                 p["selected"] = len(p["content"]) - 1
             elif utype == "image_update_selected":
                 # TODO implement python client function for this
@@ -237,16 +359,17 @@ class UpdateHandler(BaseHandler):
                     )
                     return p
 
-            # append according to direction
+            # append according to direction, in place for the patch to only
+            # hold the new values, see update_heatmap_packet
             if updateDir == "appendRow":
                 plot["z"] += dz
                 if updateNames:
                     plot["y"] += new_data["y"]
 
             elif updateDir == "prependRow":
-                plot["z"] = dz + plot["z"]
+                plot["z"][:0] = dz
                 if updateNames:
-                    plot["y"] = new_data["y"] + plot["y"]
+                    plot["y"][:0] = new_data["y"]
 
             elif updateDir == "appendColumn":
                 for i, dzi in enumerate(dz):
@@ -256,9 +379,9 @@ class UpdateHandler(BaseHandler):
 
             elif updateDir == "prependColumn":
                 for i, dzi in enumerate(dz):
-                    plot["z"][i] = dzi + plot["z"][i]
+                    plot["z"][i][:0] = dzi
                 if updateNames:
-                    plot["x"] = new_data["x"] + plot["x"]
+                    plot["x"][:0] = new_data["x"]
 
             # update opts
             # note: if we are appending, we do not want to modify the labels, as they have already been altered above
@@ -332,6 +455,19 @@ class UpdateHandler(BaseHandler):
             return
 
         p = handler.state[eid]["jsons"][args["win"]]
+        if p["type"] == "embeddings":
+            # hover previews are cached to answer the next hovers of their
+            # entities, prefetched ones are only cached
+            update = args["data"]
+            if update["update_type"] == "Previews":
+                for idx, preview in update["previews"].items():
+                    handler.app.previews.put(p, idx, preview)
+                handler.write(p["id"])
+                return
+            if update["update_type"] == "EntitySelected" and "idx" in update:
+                handler.app.previews.put(p, update["idx"], update["selected"])
+
+        p = own_window(handler.state[eid], args["win"])
 
         if not (
             p["type"] == "text"
@@ -353,9 +489,15 @@ class UpdateHandler(BaseHandler):
             )
             return
 
+        # the patches of histories and heatmaps are built directly, and much
+        # smaller than their frames or matrix
+        direct = (
+            p["type"] == "image_history"
+            or UpdateHandler.heatmap_trace(p, args) is not None
+        )
         p, diff_packet = UpdateHandler.update_packet(p, args)
         # send the smaller of the patch and the updated pane
-        if len(stringify(p)) <= len(stringify(diff_packet)):
+        if not direct and len(stringify(p)) <= len(stringify(diff_packet)):
             broadcast(handler, p, eid)
         else:
             broadcast_packet = {
@@ -369,13 +511,17 @@ class UpdateHandler(BaseHandler):
         handler.write(p["id"])
 
     @check_auth
-    def post(self):
+    async def post(self):
         if self.login_enabled and not self.current_user:
             self.set_status(400)
             return
         args = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )
+        if self.blob_store is not None:
+            self.blob_store.store_media(args)
+        if await self.forward_request(args, eid=extract_eid(args)):
+            return
         self.wrap_func(self, args)
 
 
@@ -399,10 +545,12 @@ class CloseHandler(BaseHandler):
             broadcast(handler, json.dumps({"command": "close", "data": win}), eid)
 
     @check_auth
-    def post(self):
+    async def post(self):
         args = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )
+        if await self.forward_request(args, eid=extract_eid(args)):
+            return
         self.wrap_func(self, args)
 
 
@@ -423,13 +571,17 @@ class DeleteEnvHandler(BaseHandler):
             if handler.env_path is not None:
                 p = os.path.join(handler.env_path, "{0}.json".format(eid))
                 os.remove(p)
+                collect_snapshots(handler.env_path)
+            relay_env(handler, eid)
             broadcast_envs(handler)
 
     @check_auth
-    def post(self):
+    async def post(self):
         args = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )
+        if await self.forward_request(args, eid=extract_eid(args)):
+            return
         self.wrap_func(self, args)
 
 
@@ -467,17 +619,21 @@ class ForkEnvHandler(BaseHandler):
 
         assert prev_eid in handler.state, "env to be forked doesn't exit"
 
-        handler.state[eid] = copy.deepcopy(handler.state[prev_eid])
+        fork_env(handler.state, prev_eid, eid, env_path=handler.app.env_path)
         serialize_env(handler.state, [eid], env_path=handler.app.env_path)
+        collect_snapshots(handler.app.env_path)
+        relay_env(handler, eid)
         broadcast_envs(handler)
 
         handler.write(eid)
 
     @check_auth
-    def post(self):
+    async def post(self):
         args = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )
+        if await self.forward_request(args, eid=escape_eid(args.get("eid"))):
+            return
         self.wrap_func(self, args)
 
 
@@ -503,19 +659,28 @@ class EnvHandler(BaseHandler):
             wrap_socket=self.wrap_socket,
         )
 
+    @staticmethod
+    def wrap_func(handler, args):
+        sid = args["sid"]
+        if sid in handler.subs:
+            load_env(
+                handler.state, args["env"], handler.subs[sid], env_path=handler.env_path
+            )
+
     @check_auth
-    def post(self, args):
+    async def post(self, args):
         msg_args = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )
         if "sid" in msg_args:
-            sid = msg_args["sid"]
-            if sid in self.subs:
-                load_env(self.state, args, self.subs[sid], env_path=self.env_path)
+            load_args = {"sid": msg_args["sid"], "env": args}
+            if not await self.forward_request(load_args, sid=msg_args["sid"]):
+                self.wrap_func(self, load_args)
         if "eid" in msg_args:
             eid = msg_args["eid"]
             if eid not in self.state:
                 self.state[eid] = {"jsons": {}, "reload": {}}
+                relay_env(self, eid, create_only=True)
                 broadcast_envs(self)
 
 
@@ -543,13 +708,26 @@ class CompareHandler(BaseHandler):
             wrap_socket=self.wrap_socket,
         )
 
+    @staticmethod
+    def wrap_func(handler, args):
+        sid = args["sid"]
+        if sid in handler.subs:
+            compare_envs(
+                handler.state,
+                args["envs"].split("+"),
+                handler.subs[sid],
+                handler.env_path,
+            )
+
     @check_auth
-    def post(self, args):
+    async def post(self, args):
         sid = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )["sid"]
-        if sid in self.subs:
-            compare_envs(self.state, args.split("+"), self.subs[sid], self.env_path)
+        compare_args = {"sid": sid, "envs": args}
+        if await self.forward_request(compare_args, sid=sid):
+            return
+        self.wrap_func(self, compare_args)
 
 
 class SaveHandler(BaseHandler):
@@ -601,6 +779,7 @@ class DataHandler(BaseHandler):
             else:
                 handler.state[eid]["jsons"][args["win"]] = data
 
+            relay_env(handler, eid)
             broadcast_envs(handler)
         else:
             # Dump data to client
@@ -613,10 +792,12 @@ class DataHandler(BaseHandler):
                 handler.write(json.dumps(handler.state[eid]["jsons"][args["win"]]))
 
     @check_auth
-    def post(self):
+    async def post(self):
         args = tornado.escape.json_decode(
             tornado.escape.to_basestring(self.request.body)
         )
+        if await self.forward_request(args, eid=extract_eid(args)):
+            return
         self.wrap_func(self, args)
 
 
@@ -666,6 +847,63 @@ class IndexHandler(BaseHandler):
             self.set_status(400)
 
 
+class MetricsHandler(BaseHandler):
+    def initialize(self, app):
+        self.app = app
+        self.login_enabled = app.login_enabled
+
+    @check_auth
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(exposition(collect(self.app)))
+
+
+class ProfileHandler(BaseHandler):
+    """
+    Samples the stacks of the server's IOLoop thread for `seconds` and returns
+    a summary of the top functions followed by the collapsed stacks, or only
+    the collapsed stacks with `format=collapsed` (for flamegraphs).
+    """
+
+    def initialize(self, app):
+        self.login_enabled = app.login_enabled
+
+    @check_auth
+    async def get(self):
+        try:
+            seconds = float(self.get_argument("seconds", "10"))
+        except ValueError:
+            self.set_status(400)
+            return
+        seconds = min(max(seconds, 0), MAX_PROFILE_SECONDS)
+        sampler = await tornado.ioloop.IOLoop.current().run_in_executor(
+            None, profile_thread, threading.get_ident(), seconds
+        )
+        if sampler is None:
+            self.set_status(409)
+            self.write("A profile is already running")
+            return
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        if self.get_argument("format", None) != "collapsed":
+            self.write(sampler.summary() + "\n")
+        self.write(sampler.collapsed())
+
+
+class StallsHandler(BaseHandler):
+    """Returns the last stalls of the IOLoop, oldest first"""
+
+    def initialize(self, app):
+        self.app = app
+        self.login_enabled = app.login_enabled
+
+    @check_auth
+    def get(self):
+        detector = self.app.stall_detector
+        stalls = [] if detector is None else list(detector.stalls)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(stalls))
+
+
 class UserSettingsHandler(BaseHandler):
     def initialize(self, app):
         self.user_settings = app.user_settings
@@ -681,3 +919,133 @@ class ErrorHandler(BaseHandler):
     def get(self, text):
         error_text = text or "test error"
         raise Exception(error_text)
+
+
+class StaticHandler(tornado.web.StaticFileHandler):
+    """
+    Serves the static files of a production server. Sends the precompressed
+    variant of a file when the browser accepts its encoding, and lets the
+    browsers cache the versioned urls of `static_url` for good.
+    """
+
+    ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+    IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+    def get_accepted_encodings(self):
+        encodings = set()
+        for part in self.request.headers.get("Accept-Encoding", "").split(","):
+            encoding, _, params = part.partition(";")
+            params = params.replace(" ", "")
+            if params.startswith("q=") and params[2:].strip("0.") == "":
+                continue  # q=0 explicitly refuses the encoding
+            encodings.add(encoding.strip().lower())
+        return encodings
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super().validate_absolute_path(root, absolute_path)
+        self.original_path = absolute_path
+        self.content_encoding = None
+        if absolute_path is None:
+            return None
+        accepted = self.get_accepted_encodings()
+        for encoding, ext in self.ENCODINGS:
+            compressed_path = absolute_path + ext
+            if (
+                encoding in accepted
+                and os.path.isfile(compressed_path)
+                and os.path.getmtime(compressed_path) >= os.path.getmtime(absolute_path)
+            ):
+                self.content_encoding = encoding
+                # the size and modified time are those of the variant sent
+                self._stat_result = os.stat(compressed_path)
+                return compressed_path
+        return absolute_path
+
+    def get_content_type(self):
+        mime_type, _ = mimetypes.guess_type(self.original_path)
+        return mime_type or "application/octet-stream"
+
+    def set_extra_headers(self, path):
+        self.set_header("Vary", "Accept-Encoding")
+        if self.content_encoding is not None:
+            self.set_header("Content-Encoding", self.content_encoding)
+        if "v" in self.request.arguments:
+            self.set_header(
+                "Cache-Control",
+                "public, max-age={}, immutable".format(self.IMMUTABLE_MAX_AGE),
+            )
+
+
+class BlobHandler(tornado.web.StaticFileHandler):
+    """
+    Serves the media of the blob store. A blob never changes, as it is named
+    after the hash of its content, so browsers can cache it for good.
+    """
+
+    IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+    def initialize(self, app):
+        super().initialize(path=app.blob_store.blob_dir)
+        self.login_enabled = app.login_enabled
+
+    @check_auth
+    def get(self, path, include_body=True):
+        return super().get(path, include_body)
+
+    @classmethod
+    def get_absolute_path(cls, root, path):
+        return os.path.abspath(os.path.join(root, path[:2], path))
+
+    def compute_etag(self):
+        # the name of the blob is the hash of its content
+        return '"{}"'.format(self.path.split(".")[0])
+
+    def get_content_type(self):
+        return MEDIA_TYPES.get(self.path.split(".")[-1], "application/octet-stream")
+
+    def set_extra_headers(self, path):
+        self.set_header(
+            "Cache-Control",
+            "public, max-age={}, immutable".format(self.IMMUTABLE_MAX_AGE),
+        )
+
+
+@tornado.web.stream_request_body
+class BlobUploadHandler(BaseHandler):
+    """
+    Stores the media posted as raw bytes, of the type of the request, and
+    writes back the url of the blob. The bytes are written to disk as they
+    are received, so large videos are never held in memory.
+    """
+
+    def initialize(self, app):
+        self.blob_store = app.blob_store
+        self.login_enabled = app.login_enabled
+        self.upload = None
+
+    def prepare(self):
+        if self.blob_store is None:
+            raise tornado.web.HTTPError(404, "the server does not store blobs")
+        if self.login_enabled and not self.current_user:
+            raise tornado.web.HTTPError(400)
+        content_type = self.request.headers.get("Content-Type", "")
+        ext = EXTENSIONS.get(content_type.split(";")[0].strip())
+        if ext is None:
+            raise tornado.web.HTTPError(415, "unknown media type %s", content_type)
+        self.request.connection.set_max_body_size(MAX_UPLOAD_SIZE)
+        self.upload = self.blob_store.open_upload(ext)
+
+    def data_received(self, chunk):
+        self.upload.write(chunk)
+
+    def post(self):
+        name = self.upload.commit()
+        self.write(self.blob_store.url_prefix + name)
+
+    def on_finish(self):
+        if self.upload is not None:
+            self.upload.discard()
+
+    def on_connection_close(self):
+        if self.upload is not None:
+            self.upload.discard()
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Load generator measuring how many training clients and viewers a server
+can sustain.
+
+Writer clients append to their own window (line, scatter, image or heatmap)
+at a given rate, while viewers subscribed to the envs over /socket receive
+the resulting updates. Reports the ingest throughput, the latency from an
+append being sent to a viewer receiving it, and the CPU and memory used by
+the server, and writes them as json to compare releases.
+
+    python -m visdom.server.loadtest -writers 8 -viewers 16 -duration 30
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+import tornado.locks
+import tornado.netutil
+import tornado.websocket
+
+import visdom
+
+PLOT_TYPES = ["line", "scatter", "image", "heatmap"]
+PAYLOAD_POOL = 8  # distinct payloads cycled by each writer
+RSS_SAMPLE_INTERVAL = 0.5  # seconds
+SERVER_START_TIMEOUT = 30  # seconds
+
+
+def build_payloads(plot_type, win, env, points):
+    """
+    Messages creating the window of a writer and appending to it, built by
+    the python client without sending them.
+    """
+    vis = visdom.Visdom(send=False, use_incoming_socket=False, env=env)
+    rand = np.random.rand
+
+    if plot_type == "line":
+
+        def build(update):
+            return vis.line(Y=rand(points), X=np.arange(points), win=win, update=update)
+
+    elif plot_type == "scatter":
+
+        def build(update):
+            return vis.scatter(X=rand(points, 2), win=win, update=update)
+
+    elif plot_type == "image":
+        side = max(int(points**0.5), 1)
+
+        def build(update):
+            return vis.image(rand(3, side, side), win=win, opts={"store_history": True})
+
+    elif plot_type == "heatmap":
+
+        def build(update):
+            return vis.heatmap(
+                rand(1, points), win=win, update="appendRow" if update else None
+            )
+
+    else:
+        raise ValueError("Unknown plot type " + plot_type)
+
+    create, _ = build(None)
+    appends = [build("append") for _ in range(PAYLOAD_POOL)]
+    return (
+        ("events", json.dumps(create)),
+        [(endpoint, json.dumps(msg)) for msg, endpoint in appends],
+    )
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return float(np.percentile(values, q))
+
+
+# ---- server process accounting ---- #
+
+
+def process_tree(pid):
+    """The pid of a process and of all of its descendants (linux only)"""
+    pids = [pid]
+    for pid in pids:
+        task_dir = "/proc/{}/task".format(pid)
+        try:
+            for tid in os.listdir(task_dir):
+                with open(os.path.join(task_dir, tid, "children")) as fn:
+                    pids.extend(int(child) for child in fn.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def cpu_seconds(pids):
+    total = 0.0
+    for pid in pids:
+        try:
+            with open("/proc/{}/stat".format(pid)) as fn:
+                fields = fn.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/{}/statm".format(pid)) as fn:
+                total += int(fn.read().split()[1]) * mmap.PAGESIZE
+        except OSError:
+            continue
+    return total
+
+
+class ServerProcess:
+    """A server started in a subprocess for the duration of the test"""
+
+    def __init__(self, port, server_args):
+        self.env_path = tempfile.mkdtemp(prefix="visdom_loadtest_")
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from visdom.server.run_server import main; main()",
+                "-port",
+                str(port),
+                "-env_path",
+                self.env_path,
+                "-logging_level",
+                "WARNING",
+            ]
+            + server_args,
+            stdout=subprocess.DEVNULL,
+        )
+        self.pid = self.process.pid
+
+    def stop(self):
+        for pid in reversed(process_tree(self.pid)):
+            try:
+                os.kill(pid, 15)
+            except OSError:
+                pass
+        self.process.wait()
+        shutil.rmtree(self.env_path, ignore_errors=True)
+
+
+# ---- clients ---- #
+
+
+class LoadTest:
+    def __init__(self, url, writers, viewers, rate, duration, points, plot_types, envs):
+        self.url = url.rstrip("/")
+        self.num_writers = writers
+        self.num_viewers = viewers
+        self.rate = rate
+        self.duration = duration
+        self.points = points
+        self.plot_types = plot_types
+        self.envs = ["loadtest_{}".format(i) for i in range(envs)]
+        self.http = tornado.httpclient.AsyncHTTPClient(max_clients=max(writers, 10))
+        self.sent_times = {}  # window -> time each of its messages was sent
+        self.latencies = []
+        self.appends = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.messages_received = 0
+        self.connections = []
+        self.running = False
+        self.timing = False
+
+    def windows(self):
+        for i in range(self.num_writers):
+            plot_type = self.plot_types[i % len(self.plot_types)]
+            env = self.envs[i % len(self.envs)]
+            yield "load_{}_{}".format(plot_type, i), plot_type, env
+
+    async def post(self, endpoint, body):
+        try:
+            await self.http.fetch(
+                "{}/{}".format(self.url, endpoint), method="POST", body=body
+            )
+            return True
+        except Exception as exc:
+            self.errors += 1
+            logging.debug("Request to {} failed: {}".format(endpoint, exc))
+            return False
+
+    async def viewer(self, env, subscribed):
+        ws_url = "ws" + self.url[len("http") :] + "/socket"
+        conn = await tornado.websocket.websocket_connect(
+            ws_url, max_message_size=1024**3
+        )
+        self.connections.append(conn)
+        sid = json.loads(await conn.read_message())["data"]
+        await self.post("env/" + env, json.dumps({"sid": sid, "eid": env}))
+        subscribed.append(env)
+        received = {}
+        while self.running:
+            message = await conn.read_message()
+            now = time.perf_counter()
+            if message is None:
+                break
+            msg = json.loads(message)
+            command = msg.get("command")
+            if command == "window":
+                win = msg["id"]
+            elif command == "window_update":
+                win = msg["win"]
+            else:
+                continue
+            index = received.get(win, 0)
+            received[win] = index + 1
+            self.messages_received += 1
+            sent = self.sent_times.get(win)
+            if index > 0 and sent is not None and index < len(sent):
+                if self.timing:
+                    self.latencies.append(now - sent[index])
+
+    async def writer(self, win, plot_type, env, start):
+        create, appends = build_payloads(plot_type, win, env, self.points)
+        # the viewers match the n-th message of a window with its n-th send,
+        # so only the sends that the server accepted are kept
+        sent = self.sent_times[win] = [time.perf_counter()]
+        if not await self.post(*create):
+            sent.pop()
+        await start.wait()
+        begin = time.perf_counter()
+        i = 0
+        while self.running:
+            endpoint, body = appends[i % len(appends)]
+            sent.append(time.perf_counter())
+            if await self.post(endpoint, body):
+                self.appends += 1
+                self.bytes_sent += len(body)
+            else:
+                sent.pop()
+            i += 1
+            delay = begin + i / self.rate - time.perf_counter()
+            if delay > 0:
+                await tornado.gen.sleep(delay)
+
+    async def run(self, server_pid=None):
+        """Run the test, measuring the server process if its pid is given"""
+        self.running = True
+        subscribed = []
+        for i in range(self.num_viewers):
+            tornado.ioloop.IOLoop.current().spawn_callback(
+                self.viewer, self.envs[i % len(self.envs)], subscribed
+            )
+        while len(subscribed) < self.num_viewers:
+            await tornado.gen.sleep(0.05)
+
+        start = tornado.locks.Event()
+        writers = tornado.gen.multi(
+            [self.writer(*window, start) for window in self.windows()]
+        )
+        await tornado.gen.sleep(1)  # windows created and sent to the viewers
+
+        pids = process_tree(server_pid) if server_pid else []
+        rss_peak = rss_bytes(pids) if pids else None
+        cpu_start = cpu_seconds(pids) if pids else None
+        client_start = time.process_time()
+        wall_start = time.perf_counter()
+        self.timing = True
+        start.set()
+        while time.perf_counter() - wall_start < self.duration:
+            await tornado.gen.sleep(RSS_SAMPLE_INTERVAL)
+            if pids:
+                rss_peak = max(rss_peak, rss_bytes(process_tree(server_pid)))
+        self.running = False
+        await writers
+        wall = time.perf_counter() - wall_start
+        await tornado.gen.sleep(0.5)  # let the last updates reach the viewers
+        self.timing = False
+        client_end = time.process_time()
+        for conn in self.connections:
+            conn.close()
+
+        server_cpu = None
+        if pids:
+            server_cpu = cpu_seconds(process_tree(server_pid)) - cpu_start
+        client_cpu = client_end - client_start
+        latencies_ms = [1000 * latency for latency in self.latencies]
+        return {
+            "appends": self.appends,
+            "errors": self.errors,
+            "appends_per_second": self.appends / wall,
+            "ingest_bytes_per_second": self.bytes_sent / wall,
+            "viewer_messages": self.messages_received,
+            "latency_ms": {
+                "p50": percentile(latencies_ms, 50),
+                "p90": percentile(latencies_ms, 90),
+                "p99": percentile(latencies_ms, 99),
+                "max": max(latencies_ms, default=None),
+            },
+            "server_cpu_seconds": server_cpu,
+            "server_cpu_utilization": None if server_cpu is None else server_cpu / wall,
+            "server_rss_peak_bytes": rss_peak,
+            "client_cpu_utilization": client_cpu / wall,
+            "wall_seconds": wall,
+        }
+
+
+def print_results(results):
+    res = results["results"]
+    latency = res["latency_ms"]
+
+    def fmt(value, spec="{:.1f}"):
+        return "n/a" if value is None else spec.format(value)
+
+    print("appends:          {} ({} errors)".format(res["appends"], res["errors"]))
+    print("throughput:       {:.1f} appends/s".format(res["appends_per_second"]))
+    print("ingest:           {:.2f} MB/s".format(res["ingest_bytes_per_second"] / 1e6))
+    print("viewer messages:  {}".format(res["viewer_messages"]))
+    print(
+        "latency (ms):     p50 {} / p90 {} / p99 {} / max {}".format(
+            fmt(latency["p50"]),
+            fmt(latency["p90"]),
+            fmt(latency["p99"]),
+            fmt(latency["max"]),
+        )
+    )
+    print(
+        "server:           {} cpu, {} MB peak rss".format(
+            fmt(res["server_cpu_utilization"], "{:.0%}"),
+            fmt(
+                None
+                if res["server_rss_peak_bytes"] is None
+                else res["server_rss_peak_bytes"] / 1e6
+            ),
+        )
+    )
+    print("load generator:   {:.0%} cpu".format(res["client_cpu_utilization"]))
+    if res["client_cpu_utilization"] > 0.9:
+        print("*** the load generator is saturated, the results are a lower bound")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a visdom server.")
+    parser.add_argument(
+        "-url",
+        metavar="url",
+        type=str,
+        default=None,
+        help="url of a running server to test, instead of starting one.",
+    )
+    parser.add_argument(
+        "-pid",
+        metavar="pid",
+        type=int,
+        default=None,
+        help="pid of the server given by -url, to measure its cpu and memory.",
+    )
+    parser.add_argument(
+        "-in_process",
+        default=False,
+        action="store_true",
+        help="run the server in the process of the load generator.",
+    )
+    parser.add_argument(
+        "-server_args",
+        metavar="server_args",
+        type=str,
+        default="",
+        help='extra arguments of the started server, e.g. "-num_processes 4".',
+    )
+    parser.add_argument(
+        "-writers",
+        metavar="writers",
+        type=int,
+        default=4,
+        help="number of clients appending to a window.",
+    )
+    parser.add_argument(
+        "-viewers",
+        metavar="viewers",
+        type=int,
+        default=4,
+        help="number of browsers viewing the envs.",
+    )
+    parser.add_argument(
+        "-rate",
+        metavar="rate",
+        type=float,
+        default=10,
+        help="appends per second of each writer.",
+    )
+    parser.add_argument(
+        "-duration",
+        metavar="duration",
+        type=float,
+        default=10,
+        help="duration of the test in seconds.",
+    )
+    parser.add_argument(
+        "-points",
+        metavar="points",
+        type=int,
+        default=100,
+        help="points (or pixels) per append.",
+    )
+    parser.add_argument(
+        "-plots",
+        metavar="plots",
+        type=str,
+        default=",".join(PLOT_TYPES),
+        help="comma separated plot types the writers cycle through.",
+    )
+    parser.add_argument(
+        "-envs",
+        metavar="envs",
+        type=int,
+        default=1,
+        help="number of envs the writers and viewers are spread over.",
+    )
+    parser.add_argument(
+        "-output",
+        metavar="output",
+        type=str,
+        default=None,
+        help="write the results as json to this file.",
+    )
+    FLAGS = parser.parse_args()
+    plot_types = FLAGS.plots.split(",")
+    for plot_type in plot_types:
+        assert plot_type in PLOT_TYPES, "unknown plot type " + plot_type
+
+    server = None
+    env_path = None
+    server_pid = FLAGS.pid
+    url = FLAGS.url
+    if url is None:
+        sock = tornado.netutil.bind_sockets(0, "localhost")[0]
+        port = sock.getsockname()[1]
+        sock.close()
+        url = "http://localhost:{}".format(port)
+        if FLAGS.in_process:
+            from visdom.server.app import Application
+
+            env_path = tempfile.mkdtemp(prefix="visdom_loadtest_")
+            Application(port=port, env_path=env_path).listen(port)
+            server_pid = os.getpid()
+        else:
+            server = ServerProcess(port, FLAGS.server_args.split())
+            server_pid = server.pid
+
+    async def run():
+        deadline = time.time() + SERVER_START_TIMEOUT
+        http = tornado.httpclient.AsyncHTTPClient()
+        while True:
+            try:
+                await http.fetch(url + "/env_state", method="POST", body="{}")
+                break
+            except Exception:
+                if time.time() > deadline:
+                    raise
+                await tornado.gen.sleep(0.2)
+        test = LoadTest(
+            url,
+            FLAGS.writers,
+            FLAGS.viewers,
+            FLAGS.rate,
+            FLAGS.duration,
+            FLAGS.points,
+            plot_types,
+            FLAGS.envs,
+        )
+        return await test.run(server_pid)
+
+    try:
+        results = tornado.ioloop.IOLoop.current().run_sync(run)
+    finally:
+        if server is not None:
+            server.stop()
+        if env_path is not None:
+            shutil.rmtree(env_path, ignore_errors=True)
+
+    results = {
+        "visdom_version": visdom.__version__,
+        "python_version": platform.python_version(),
+        "time": time.time(),
+        "config": {
+            "url": FLAGS.url,
+            "in_process": FLAGS.in_process,
+            "server_args": FLAGS.server_args,
+            "writers": FLAGS.writers,
+            "viewers": FLAGS.viewers,
+            "rate": FLAGS.rate,
+            "duration": FLAGS.duration,
+            "points": FLAGS.points,
+            "plots": plot_types,
+            "envs": FLAGS.envs,
+        },
+        "results": results,
+    }
+    print_results(results)
+    if FLAGS.output is not None:
+        with open(FLAGS.output, "w") as fn:
+            json.dump(results, fn, indent=2)
+
+
+if __name__ == "__main__":
+    main()
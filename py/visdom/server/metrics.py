@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Internal metrics of the server, exported on /metrics in the Prometheus text
+exposition format.
+
+Counters and histograms are plain numbers updated in place by the code paths
+they measure, so that recording them stays negligible next to the work being
+measured. Gauges (subscribers, envs, ...) are only computed from the server
+state when the metrics are scraped, except for the memory of the state: a
+scrape starts measuring it in the background, a chunk of objects at a time,
+and exports the last measure. Each server process keeps and exports its own
+metrics.
+"""
+
+import bisect
+import sys
+import time
+from collections import defaultdict
+
+import tornado.gen
+import tornado.ioloop
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+STATE_MEMORY_INTERVAL = 60  # seconds between two measures of the state memory
+SIZE_CHUNK = 10000  # objects measured before yielding to the IOLoop
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            bucket_labels = dict(labels, le=str(bound))
+            yield name + "_bucket", bucket_labels, cumulative
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, cumulative
+
+
+class Metrics:
+    """Counters and histograms updated while the server runs"""
+
+    def __init__(self):
+        self.requests = defaultdict(int)  # (handler, code) -> count
+        self.request_seconds = defaultdict(Histogram)  # handler -> histogram
+        self.broadcasts = 0
+        self.broadcast_messages = 0
+        self.broadcast_bytes = 0
+        self.serialize_seconds = Histogram()
+        self.state_memory_bytes = None  # not measured yet
+        self.state_measured_at = None
+        self.measuring_state = False
+
+    def observe_request(self, handler):
+        name = type(handler).__name__
+        self.requests[(name, handler.get_status())] += 1
+        self.request_seconds[name].observe(handler.request.request_time())
+
+    def observe_broadcast(self, num_messages, num_bytes):
+        self.broadcasts += 1
+        self.broadcast_messages += num_messages
+        self.broadcast_bytes += num_bytes
+
+    def measure_state(self, envs):
+        """Measure the memory of the loaded envs in the background, if due"""
+        if self.measuring_state or (
+            self.state_measured_at is not None
+            and time.time() - self.state_measured_at < STATE_MEMORY_INTERVAL
+        ):
+            return
+        self.measuring_state = True
+        tornado.ioloop.IOLoop.current().spawn_callback(self._measure_state, envs)
+
+    async def _measure_state(self, envs):
+        try:
+            self.state_memory_bytes = await approximate_size(envs)
+        finally:
+            self.measuring_state = False
+            self.state_measured_at = time.time()
+
+
+METRICS = Metrics()
+
+
+async def approximate_size(obj, chunk=SIZE_CHUNK):
+    """
+    Approximate memory used by a json-like object, counting the objects
+    shared between several envs (e.g. by forks) once. Yields to the IOLoop
+    every `chunk` objects, so envs may change while they are measured.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    count = 0
+    while stack:
+        count += 1
+        if count % chunk == 0:
+            await tornado.gen.sleep(0)
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return size
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                key,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for key, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def exposition(families):
+    """
+    Render metric families, given as (name, type, help, samples) where each
+    sample is (name, labels, value), in the Prometheus text format.
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        for sample_name, labels, value in samples:
+            lines.append(
+                "{}{} {}".format(
+                    sample_name, _format_labels(labels), _format_value(value)
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def collect(app, metrics=METRICS):
+    """Gather the metrics of the server, including gauges computed from its state"""
+    from visdom.utils.server_utils import LazyEnvData
+
+    base_labels = {}
+    if getattr(app, "bus", None) is not None:
+        base_labels["worker"] = app.bus.task_id
+
+    def labeled(**labels):
+        return dict(base_labels, **labels)
+
+    envs = {"loaded": 0, "lazy": 0}
+    loaded = []
+    for env in app.state.values():
+        if isinstance(env, LazyEnvData):
+            if env._raw_dict is None:
+                envs["lazy"] += 1
+                continue
+            env = env._raw_dict
+        if isinstance(env, dict):
+            envs["loaded"] += 1
+            loaded.append(env)
+    metrics.measure_state(loaded)
+    state_memory = []
+    if metrics.state_memory_bytes is not None:
+        state_memory.append(
+            ("visdom_state_memory_bytes", labeled(), metrics.state_memory_bytes)
+        )
+
+    queues = [
+        len(socket.messages)
+        for sockets in (app.subs, app.sources)
+        for socket in sockets.values()
+        if hasattr(socket, "messages")
+    ]
+
+    request_seconds = [
+        sample
+        for name, histogram in sorted(metrics.request_seconds.items())
+        for sample in histogram.samples(
+            "visdom_request_duration_seconds", labeled(handler=name)
+        )
+    ]
+
+    return [
+        (
+            "visdom_requests_total",
+            "counter",
+            "HTTP requests handled, by handler class and status code.",
+            [
+                ("visdom_requests_total", labeled(handler=name, code=code), count)
+                for (name, code), count in sorted(metrics.requests.items())
+            ],
+        ),
+        (
+            "visdom_request_duration_seconds",
+            "histogram",
+            "Time spent handling HTTP requests, by handler class.",
+            request_seconds,
+        ),
+        (
+            "visdom_broadcasts_total",
+            "counter",
+            "Window updates broadcast to the subscribers of an env.",
+            [("visdom_broadcasts_total", labeled(), metrics.broadcasts)],
+        ),
+        (
+            "visdom_broadcast_messages_total",
+            "counter",
+            "Messages sent to subscribers by broadcasts (fan-out).",
+            [
+                (
+                    "visdom_broadcast_messages_total",
+                    labeled(),
+                    metrics.broadcast_messages,
+                )
+            ],
+        ),
+        (
+            "visdom_broadcast_bytes_total",
+            "counter",
+            "Size of the messages sent to subscribers by broadcasts.",
+            [("visdom_broadcast_bytes_total", labeled(), metrics.broadcast_bytes)],
+        ),
+        (
+            "visdom_subscribers",
+            "gauge",
+            "Connected browser clients.",
+            [("visdom_subscribers", labeled(), len(app.subs))],
+        ),
+        (
+            "visdom_sources",
+            "gauge",
+            "Connected python clients.",
+            [("visdom_sources", labeled(), len(app.sources))],
+        ),
+        (
+            "visdom_polling_queue_messages",
+            "gauge",
+            "Messages queued for the clients using polling instead of sockets.",
+            [("visdom_polling_queue_messages", labeled(), sum(queues))],
+        ),
+        (
+            "visdom_polling_queue_max_messages",
+            "gauge",
+            "Longest queue of messages of a single polling client.",
+            [("visdom_polling_queue_max_messages", labeled(), max(queues, default=0))],
+        ),
+        (
+            "visdom_envs",
+            "gauge",
+            "Envs held by the server, loaded in memory or not loaded yet.",
+            [
+                ("visdom_envs", labeled(state=state), count)
+                for state, count in envs.items()
+            ],
+        ),
+        (
+            "visdom_state_memory_bytes",
+            "gauge",
+            "Approximate memory used by the loaded envs, as last measured.",
+            state_memory,
+        ),
+        (
+            "visdom_serialize_duration_seconds",
+            "histogram",
+            "Time spent writing envs to disk.",
+            list(
+                metrics.serialize_seconds.samples(
+                    "visdom_serialize_duration_seconds", labeled()
+                )
+            ),
+        ),
+    ]
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Read-only follower servers.
+
+A leader server publishes the changes made to its envs (window creates,
+patches and closes, as well as env and layout changes) on a change stream,
+a unix domain socket that followers connect to. Each follower first receives
+a snapshot of the leader's state, then applies the stream of changes to its
+own replica and serves browsers independently of the leader. Followers run on
+the same machine as their leader, and serve the media of its blob store.
+"""
+
+import json
+import logging
+import os
+import socket
+
+import tornado.escape
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.tcpserver
+import tornado.web
+
+from visdom.server.app import Application
+from visdom.server.blobs import BLOB_NAME, BlobStore
+from visdom.server.bus import MAX_MESSAGE_SIZE, apply_change
+from visdom.server.handlers.base_handlers import BaseHandler
+from visdom.server.handlers.web_handlers import (
+    BlobHandler,
+    BlobUploadHandler,
+    CloseHandler,
+    DataHandler,
+    DeleteEnvHandler,
+    EnvHandler,
+    ForkEnvHandler,
+    IndexHandler,
+    PostHandler,
+    SaveHandler,
+    UpdateHandler,
+)
+from visdom.utils.server_utils import (
+    LazyEnvData,
+    broadcast_envs,
+    check_auth,
+    load_env,
+)
+
+RECONNECT_DELAY = 1  # seconds
+
+# Messages that followers have to apply
+FOLLOWER_KINDS = ["broadcast", "broadcast_envs", "env", "layouts"]
+
+
+def snapshot(app):
+    """The current state of a server, as sent to a newly connected follower"""
+    envs = {}
+    for eid, env in app.state.items():
+        if isinstance(env, LazyEnvData) and env._raw_dict is None:
+            # followers run on the same machine, let them load it themselves
+            envs[eid] = {"path": os.path.abspath(env._env_path_file)}
+        else:
+            envs[eid] = {"env": {"jsons": env["jsons"], "reload": env["reload"]}}
+    msg = {"kind": "snapshot", "envs": envs, "layouts": app.layouts}
+    if app.blob_store is not None:
+        msg["blob_env_path"] = os.path.dirname(os.path.abspath(app.blob_store.blob_dir))
+    return msg
+
+
+class ChangeStream(tornado.tcpserver.TCPServer):
+    """
+    Publishes the changes of a leader server to its followers.
+    """
+
+    def __init__(self, app, socket_path):
+        super().__init__()
+        self.app = app
+        self.followers = set()
+        self.add_socket(tornado.netutil.bind_unix_socket(socket_path))
+
+    async def handle_stream(self, stream, address):
+        stream.max_write_buffer_size = MAX_MESSAGE_SIZE
+        logging.info("Follower connected to the change stream")
+        self._write(stream, json.dumps(snapshot(self.app)).encode("utf-8") + b"\n")
+        self.followers.add(stream)
+
+    def _write(self, stream, data):
+        try:
+            stream.write(data)
+        except tornado.iostream.StreamClosedError:
+            self.followers.discard(stream)
+        except tornado.iostream.StreamBufferFullError:
+            # the follower can't keep up, it will resync when reconnecting
+            logging.warning("Dropping follower that fell behind the change stream")
+            self.followers.discard(stream)
+            stream.close()
+
+    def publish(self, kind, **payload):
+        if kind not in FOLLOWER_KINDS or not self.followers:
+            return
+        payload["kind"] = kind
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        for stream in list(self.followers):
+            self._write(stream, data)
+
+
+class ChangeFollower:
+    """
+    Keeps the state of a follower server in sync with the change stream of
+    its leader, reconnecting whenever the connection is lost.
+    """
+
+    def __init__(self, app, socket_path):
+        self.app = app
+        self.socket_path = socket_path
+
+    def start(self):
+        tornado.ioloop.IOLoop.current().spawn_callback(self.follow)
+
+    async def follow(self):
+        while True:
+            stream = tornado.iostream.IOStream(
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM),
+                max_buffer_size=MAX_MESSAGE_SIZE,
+            )
+            try:
+                await stream.connect(self.socket_path)
+                logging.info("Following the change stream at " + self.socket_path)
+                while True:
+                    line = await stream.read_until(b"\n")
+                    try:
+                        self.on_message(json.loads(line))
+                    except Exception:
+                        logging.exception("Failed to apply change from the leader")
+            except (tornado.iostream.StreamClosedError, OSError):
+                pass
+            await tornado.gen.sleep(RECONNECT_DELAY)
+
+    def on_message(self, msg):
+        app = self.app
+        if msg["kind"] != "snapshot":
+            apply_change(app, msg)
+            return
+
+        app.state.clear()
+        for eid, env in msg["envs"].items():
+            if "path" in env:
+                app.state[eid] = LazyEnvData(env["path"])
+            else:
+                app.state[eid] = env["env"]
+        app.layouts = msg["layouts"]
+        if msg.get("blob_env_path") is not None:
+            # the windows reference the blobs of the leader
+            app.blob_store = BlobStore(msg["blob_env_path"], app.base_url)
+        broadcast_envs(app, relay=False)
+        for sub in app.subs.values():
+            if not isinstance(sub.eid, list):
+                load_env(app.state, sub.eid, sub, env_path=None)
+
+
+class FollowerHandler(BaseHandler):
+    """Rejects the requests that would modify the state of a follower"""
+
+    def initialize(self, app):
+        pass
+
+    def post(self, *args):
+        reject(self)
+
+
+def reject(handler):
+    handler.set_status(403)
+    handler.write("This server is a read-only follower")
+
+
+class FollowerDataHandler(DataHandler):
+    """Serves the data of windows, but rejects setting it"""
+
+    @check_auth
+    async def post(self):
+        args = tornado.escape.json_decode(
+            tornado.escape.to_basestring(self.request.body)
+        )
+        if "data" in args:
+            reject(self)
+            return
+        await super().post()
+
+
+class FollowerEnvHandler(EnvHandler):
+    """Loads envs for the viewers, but rejects creating them"""
+
+    @check_auth
+    async def post(self, args):
+        msg_args = tornado.escape.json_decode(
+            tornado.escape.to_basestring(self.request.body)
+        )
+        if "eid" in msg_args and msg_args["eid"] not in self.state:
+            reject(self)
+            return
+        await super().post(args)
+
+
+class FollowerBlobHandler(BlobHandler):
+    """Serves the blobs of the leader, once its snapshot is received"""
+
+    def initialize(self, app):
+        self.login_enabled = app.login_enabled
+        self.blob_store = app.blob_store
+        if self.blob_store is not None:
+            super().initialize(app)
+
+    @check_auth
+    def get(self, path, include_body=True):
+        if self.blob_store is None:
+            raise tornado.web.HTTPError(404)
+        return super().get(path, include_body)
+
+
+# Handlers that modify envs, which followers leave to their leader
+LEADER_HANDLERS = [
+    BlobUploadHandler,
+    PostHandler,
+    UpdateHandler,
+    CloseHandler,
+    DeleteEnvHandler,
+    ForkEnvHandler,
+    SaveHandler,
+]
+
+# Handlers that both read and modify envs, replaced by ones that only read
+FOLLOWER_HANDLERS = {
+    BlobHandler: FollowerBlobHandler,
+    DataHandler: FollowerDataHandler,
+    EnvHandler: FollowerEnvHandler,
+}
+
+
+class FollowerApplication(Application):
+    """
+    Read-only server replicating the state of a leader server.
+    """
+
+    def __init__(self, follow, **kwargs):
+        kwargs["readonly"] = True
+        super().__init__(**kwargs)
+        self.follower = ChangeFollower(self, follow)
+        self.follower.start()
+
+    def load_state(self):
+        return {}  # filled by the snapshot of the leader
+
+    def get_handlers(self):
+        handlers = []
+        for pattern, handler, kw in super().get_handlers():
+            if handler in LEADER_HANDLERS:
+                handler = FollowerHandler
+            elif handler is IndexHandler and self.blob_store is None:
+                # the blobs of the leader are served whatever the env_path
+                blob_pattern = r"%s/blob/(%s)" % (self.base_url, BLOB_NAME)
+                handlers.append((blob_pattern, FollowerBlobHandler, {"app": self}))
+            handlers.append((pattern, FOLLOWER_HANDLERS.get(handler, handler), kw))
+        return handlers
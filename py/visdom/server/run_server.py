@@ -14,16 +14,22 @@ import argparse
 import getpass
 import logging
 import os
+import signal
 import sys
-from tornado import ioloop
+import tempfile
+from tornado import httpserver, ioloop, netutil, process
 from visdom.server.app import Application
+from visdom.server.bus import ProcessBus
+from visdom.server.debug import StallDetector
+from visdom.server.replication import ChangeStream, FollowerApplication
+from visdom.server.sharding import RouterApplication, ShardBus
 from visdom.server.defaults import (
     DEFAULT_BASE_URL,
     DEFAULT_ENV_PATH,
     DEFAULT_HOSTNAME,
     DEFAULT_PORT,
 )
-from visdom.server.build import download_scripts
+from visdom.server.build import compress_scripts, download_scripts
 from visdom.utils.server_utils import hash_password, set_cookie
 
 
@@ -38,9 +44,50 @@ def start_server(
     use_frontend_client_polling=False,
     bind_local=False,
     eager_data_loading=False,
+    num_processes=1,
+    num_shards=0,
+    change_stream=None,
+    follow=None,
+    production=False,
+    stall_threshold=0,
 ):
     print("It's Alive!")
-    app = Application(
+    address = "127.0.0.1" if bind_local else None
+    bus = None
+    app_class = Application
+    app_kwargs = {}
+    assert (
+        num_processes == 1 or num_shards == 0
+    ), "num_processes and num_shards can't be combined"
+    assert (change_stream is None and follow is None) or (
+        num_processes == 1 and num_shards == 0
+    ), "change streams are only supported by single process servers"
+    if production:
+        compress_scripts()
+    if follow is not None:
+        app_class = FollowerApplication
+        app_kwargs["follow"] = follow
+    if num_shards > 0:
+        # One router process serving the port, plus one process per shard
+        sockets = netutil.bind_sockets(port, address=address)
+        bus_dir = tempfile.mkdtemp(prefix="visdom_shards_")
+        task_id = process.fork_processes(num_shards + 1)
+        bus = ShardBus(bus_dir, task_id, num_shards)
+        if bus.is_router:
+            app_class = RouterApplication
+        else:
+            for sock in sockets:
+                sock.close()
+            sockets = []
+    elif num_processes != 1:
+        # Bind the port before forking so that all workers share it, and give
+        # them a common directory for the sockets of the worker bus
+        sockets = netutil.bind_sockets(port, address=address)
+        bus_dir = tempfile.mkdtemp(prefix="visdom_bus_")
+        num_processes = num_processes or process.cpu_count()
+        task_id = process.fork_processes(num_processes)
+        bus = ProcessBus(bus_dir, task_id, num_processes)
+    app = app_class(
         port=port,
         base_url=base_url,
         env_path=env_path,
@@ -48,9 +95,23 @@ def start_server(
         user_credential=user_credential,
         use_frontend_client_polling=use_frontend_client_polling,
         eager_data_loading=eager_data_loading,
+        bus=bus,
+        production=production,
+        **app_kwargs,
     )
-    if bind_local:
-        app.listen(port, max_buffer_size=1024**3, address="127.0.0.1")
+    if change_stream is not None:
+        app.change_stream = ChangeStream(app, change_stream)
+    if stall_threshold > 0:
+        app.stall_detector = StallDetector(stall_threshold)
+        app.stall_detector.start()
+    if bus is not None:
+        server = httpserver.HTTPServer(app, max_buffer_size=1024**3)
+        server.add_sockets(sockets)
+        bus.start(app)
+        # exit through sys.exit on SIGTERM, so the bus cleans up at exit
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    elif bind_local:
+        app.listen(port, max_buffer_size=1024**3, address=address)
     else:
         app.listen(port, max_buffer_size=1024**3)
     logging.info("Application Started")
@@ -60,7 +121,9 @@ def start_server(
         hostname = os.environ["HOSTNAME"]
     else:
         hostname = hostname
-    if print_func is None:
+    if bus is not None and bus.task_id != 0:
+        pass  # only the first worker reports the address
+    elif print_func is None:
         print("You can navigate to http://%s:%s%s" % (hostname, port, base_url))
     else:
         print_func(port)
@@ -137,6 +200,53 @@ def main(print_func=None):
         action="store_true",
         help="Make server only accessible only from " "localhost.",
     )
+    parser.add_argument(
+        "-num_processes",
+        metavar="num_processes",
+        type=int,
+        default=1,
+        help="number of server processes sharing the port (default = 1). "
+        "Use 0 to start one process per CPU.",
+    )
+    parser.add_argument(
+        "-num_shards",
+        metavar="num_shards",
+        type=int,
+        default=0,
+        help="spread the envs over this many shard processes, behind a "
+        "routing process serving the port (default = 0, no sharding).",
+    )
+    parser.add_argument(
+        "-change_stream",
+        metavar="change_stream",
+        type=str,
+        default=None,
+        help="path of a unix socket to publish the changes to the envs on, "
+        "for follower servers to replicate.",
+    )
+    parser.add_argument(
+        "-follow",
+        metavar="follow",
+        type=str,
+        default=None,
+        help="start a read-only follower of the server publishing its "
+        "changes on this change stream socket.",
+    )
+    parser.add_argument(
+        "-production",
+        default=False,
+        action="store_true",
+        help="serve with the production profile: cached templates, "
+        "immutable versioned static urls and precompressed scripts.",
+    )
+    parser.add_argument(
+        "-stall_threshold",
+        metavar="stall_threshold",
+        type=float,
+        default=0.5,
+        help="report the requests that block the server for longer than "
+        "this many seconds (0 to disable).",
+    )
     parser.add_argument(
         "-eager_data_loading",
         default=False,
@@ -228,6 +338,12 @@ def main(print_func=None):
         use_frontend_client_polling=FLAGS.use_frontend_client_polling,
         bind_local=FLAGS.bind_local,
         eager_data_loading=FLAGS.eager_data_loading,
+        num_processes=FLAGS.num_processes,
+        num_shards=FLAGS.num_shards,
+        change_stream=FLAGS.change_stream,
+        follow=FLAGS.follow,
+        production=FLAGS.production,
+        stall_threshold=FLAGS.stall_threshold,
     )
 
 
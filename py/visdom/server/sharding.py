@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Sharded deployment of the server.
+
+The envs are spread over several shard processes by consistent hashing of
+their eid. Each shard only loads and keeps the envs it owns, from its slice
+of the files in env_path. A router process serves the web client and all of
+the sockets: it uses the regular handler table of the Application, which
+forwards requests to the shard that owns their env over the worker bus, and
+relays the broadcasts of the shards to its subscribers. The router itself
+only keeps an index of the envs present on each shard.
+"""
+
+import bisect
+import hashlib
+import json
+from collections.abc import Mapping
+
+import tornado.escape
+import tornado.gen
+import tornado.ioloop
+
+from visdom.server.app import Application
+from visdom.server.bus import ProcessBus, forwarded_handlers
+from visdom.server.handlers.web_handlers import (
+    CompareHandler,
+    EnvHandler,
+    ForkEnvHandler,
+    SaveHandler,
+)
+from visdom.utils.server_utils import (
+    broadcast,
+    broadcast_envs,
+    check_auth,
+    collect_snapshots,
+    compare_envs,
+    escape_eid,
+    get_bus,
+    load_env,
+    serialize_env,
+)
+
+RING_REPLICAS = 64  # points per shard on the hash ring
+ROUTER_ID = 0
+
+# Messages of the shards that the router has to act on
+ROUTER_KINDS = ["broadcast", "broadcast_envs", "sources"]
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """
+    Consistent hashing of env ids onto shards, so that changing the number
+    of shards only moves a small part of the envs.
+    """
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted(
+            (_hash("{}:{}".format(node, i)), node)
+            for node in nodes
+            for i in range(replicas)
+        )
+        self.hashes = [h for h, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def get_node(self, key):
+        idx = bisect.bisect(self.hashes, _hash(key)) % len(self.hashes)
+        return self.nodes[idx]
+
+
+class ShardedEnvIndex(Mapping):
+    """
+    The state of the router: maps every env to the shard that holds it.
+    Each shard reports its list of envs whenever it changes.
+    """
+
+    def __init__(self):
+        self.shard_envs = {}
+        self.owners = {}
+
+    def update_shard(self, shard_id, eids):
+        self.shard_envs[shard_id] = list(eids)
+        self.owners = {
+            eid: shard
+            for shard, shard_eids in sorted(self.shard_envs.items())
+            for eid in shard_eids
+        }
+
+    def __getitem__(self, eid):
+        return self.owners[eid]
+
+    def __iter__(self):
+        return iter(self.owners)
+
+    def __len__(self):
+        return len(self.owners)
+
+
+class ShardEnvHandler:
+    """
+    Executed on a shard on behalf of the router, to read or replace a whole
+    env. Used for the operations that involve envs on different shards.
+    """
+
+    @staticmethod
+    def wrap_func(handler, args):
+        eid = args["eid"]
+        if "env" not in args:
+            env = handler.state.get(eid)
+            if env is not None:
+                env = {"jsons": env["jsons"], "reload": env["reload"]}
+            handler.write(json.dumps(env))
+            return
+
+        if args.get("create_only") and eid in handler.state:
+            return
+        handler.state[eid] = args["env"]
+        if not args.get("create_only"):
+            serialize_env(handler.state, [eid], env_path=handler.env_path)
+            collect_snapshots(handler.env_path)
+        broadcast_envs(handler)
+
+
+class ShardBus(ProcessBus):
+    """
+    Bus of a sharded server. Process 0 is the router, and processes 1 to
+    num_shards are the shards. Shards are only connected to the router.
+    """
+
+    def __init__(self, bus_dir, task_id, num_shards):
+        self.ring = HashRing(range(1, num_shards + 1))
+        super().__init__(bus_dir, task_id, num_shards + 1)
+
+    @property
+    def is_router(self):
+        return self.task_id == ROUTER_ID
+
+    def get_peer_ids(self):
+        if self.is_router:
+            return list(range(1, self.num_processes))
+        return [ROUTER_ID]
+
+    def owner_of(self, eid):
+        return self.ring.get_node(eid)
+
+    def holds(self, eid):
+        return self.owns(eid)
+
+    def handlers(self):
+        handlers = forwarded_handlers()
+        handlers["ShardEnvHandler"] = ShardEnvHandler
+        return handlers
+
+    def on_connect(self, peer_id):
+        if not self.is_router:
+            self.publish("broadcast_envs")
+
+    def publish(self, kind, **payload):
+        # The router holds no envs, and the shards only need to tell the
+        # router about the changes of their own envs
+        if self.is_router or kind not in ROUTER_KINDS:
+            return
+        if kind == "broadcast_envs":
+            payload["eids"] = list(self.app.state.keys())
+        super().publish(kind, **payload)
+
+    def route_socket_command(self, socket, msg, message):
+        if self.is_router and msg["cmd"] == "save":
+            if "data" in msg and "eid" in msg:
+                eid = escape_eid(msg["eid"])
+                if self.owner_of(eid) == self.owner_of(msg["prev_eid"]):
+                    # the shard can fork the env without copying it
+                    return super().route_socket_command(socket, msg, message)
+                tornado.ioloop.IOLoop.current().spawn_callback(
+                    fork_env_across_shards,
+                    self,
+                    msg["prev_eid"],
+                    eid,
+                    reload=msg["data"],
+                )
+                socket.eid = eid
+            return True
+        return super().route_socket_command(socket, msg, message)
+
+    def on_message(self, msg):
+        kind = msg["kind"]
+        if kind == "broadcast":
+            broadcast(self.app, msg["msg"], msg["eid"], relay=False)
+        elif kind == "broadcast_envs":
+            self.app.state.update_shard(msg["origin"], msg["eids"])
+            broadcast_envs(self.app, relay=False)
+        else:
+            super().on_message(msg)
+
+    # ---- env operations spanning shards, run by the router ---- #
+
+    async def fetch_env(self, eid):
+        output = await self.call(self.owner_of(eid), "ShardEnvHandler", {"eid": eid})
+        return json.loads(output or "null")
+
+    async def store_env(self, eid, env, create_only=False):
+        await self.call(
+            self.owner_of(eid),
+            "ShardEnvHandler",
+            {"eid": eid, "env": env, "create_only": create_only},
+        )
+
+
+async def fork_env_across_shards(bus, prev_eid, eid, reload=None):
+    env = await bus.fetch_env(prev_eid)
+    assert env is not None, "env to be forked doesn't exit"
+    if reload is not None:
+        env["reload"] = reload
+    await bus.store_env(eid, env)
+
+
+# ------- Router handlers ---------- #
+# These replace the handlers that work on the content of several envs, or on
+# envs that may not exist yet. All other handlers forward their requests to
+# the owning shard by themselves.
+
+
+class RouterEnvHandler(EnvHandler):
+    @staticmethod
+    async def wrap_func(handler, args):
+        eid = args["env"]
+        env = await get_bus(handler).fetch_env(eid)
+        sid = args["sid"]
+        if sid in handler.subs:
+            state = {} if env is None else {eid: env}
+            load_env(state, eid, handler.subs[sid], env_path=None)
+
+    @check_auth
+    async def post(self, args):
+        msg_args = tornado.escape.json_decode(
+            tornado.escape.to_basestring(self.request.body)
+        )
+        if "sid" in msg_args:
+            await self.wrap_func(self, {"sid": msg_args["sid"], "env": args})
+        if "eid" in msg_args:
+            eid = msg_args["eid"]
+            if eid not in self.state:
+                await get_bus(self).store_env(
+                    eid, {"jsons": {}, "reload": {}}, create_only=True
+                )
+
+
+class RouterCompareHandler(CompareHandler):
+    @staticmethod
+    async def wrap_func(handler, args):
+        bus = get_bus(handler)
+        eids = args["envs"].split("+")
+        envs = await tornado.gen.multi([bus.fetch_env(eid) for eid in eids])
+        state = {eid: env for eid, env in zip(eids, envs) if env is not None}
+        sid = args["sid"]
+        if sid in handler.subs:
+            # the router keeps its copies of the envs up to date itself
+            compare_envs(state, eids, handler.subs[sid], env_path=None, replica=True)
+
+    @check_auth
+    async def post(self, args):
+        sid = tornado.escape.json_decode(
+            tornado.escape.to_basestring(self.request.body)
+        )["sid"]
+        await self.wrap_func(self, {"sid": sid, "envs": args})
+
+
+class RouterForkEnvHandler(ForkEnvHandler):
+    @check_auth
+    async def post(self):
+        args = tornado.escape.json_decode(
+            tornado.escape.to_basestring(self.request.body)
+        )
+        eid = escape_eid(args.get("eid"))
+        prev_eid = escape_eid(args.get("prev_eid"))
+        bus = get_bus(self)
+        if bus.owner_of(eid) == bus.owner_of(prev_eid):
+            # the shard can fork the env without copying it
+            await self.forward_request(args, eid=eid, name="ForkEnvHandler")
+            return
+        await fork_env_across_shards(bus, prev_eid, eid)
+        self.write(eid)
+
+
+class RouterSaveHandler(SaveHandler):
+    @check_auth
+    async def post(self):
+        args = tornado.escape.json_decode(
+            tornado.escape.to_basestring(self.request.body)
+        )
+        bus = get_bus(self)
+        shard_envs = {}
+        for eid in args["data"]:
+            eid = escape_eid(eid)
+            shard_envs.setdefault(bus.owner_of(eid), []).append(eid)
+        outputs = await tornado.gen.multi(
+            [
+                bus.call(shard, "SaveHandler", {"data": eids})
+                for shard, eids in shard_envs.items()
+            ]
+        )
+        ret = [eid for output in outputs for eid in json.loads(output or "[]")]
+        self.write(json.dumps(ret))
+
+
+ROUTER_HANDLERS = {
+    EnvHandler: RouterEnvHandler,
+    CompareHandler: RouterCompareHandler,
+    ForkEnvHandler: RouterForkEnvHandler,
+    SaveHandler: RouterSaveHandler,
+}
+
+
+class RouterApplication(Application):
+    """
+    Front-end of a sharded server. Serves the same handler table as the
+    Application, without keeping any env itself.
+    """
+
+    def load_state(self):
+        return ShardedEnvIndex()
+
+    def get_handlers(self):
+        return [
+            (pattern, ROUTER_HANDLERS.get(handler, handler), kwargs)
+            for pattern, handler, kwargs in super().get_handlers()
+        ]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Worker threads encoding and sending the media of the python client (images,
+audio and videos), so that a training loop logging them does not wait for
+PIL, scipy or PyAV.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+
+class EncodingPool:
+    """
+    Runs jobs on worker threads, from a queue of at most `max_pending` jobs.
+
+    Jobs are submitted with a key, usually the env and window they draw to.
+    A job replaces the pending job of the same key, which is cancelled: the
+    latest frame of a window wins and stale ones are skipped instead of
+    being encoded. Jobs of the same key never run concurrently and run in
+    the order they were submitted. Jobs submitted with `replace=False`, like
+    the frames of a history, and jobs without a key are never replaced.
+
+    When the queue is full, `submit` waits for a worker to take a job, which
+    bounds the memory held by the frames waiting to be encoded.
+    """
+
+    def __init__(self, num_workers=1, max_pending=8, name="Visdom-Encoder"):
+        assert num_workers > 0, "the pool needs at least one worker"
+        assert max_pending > 0, "the queue should hold at least one job"
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pending = collections.OrderedDict()  # job -> (key, future, fn)
+        self._replaceable = {}  # key -> its pending job that may be replaced
+        self._running = set()  # keys of the jobs being run
+        self._local = threading.local()
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(
+                target=self._work, name="{}-{}".format(name, i), daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def in_worker(self):
+        """Whether the calling thread is one of the workers"""
+        return getattr(self._local, "is_worker", False)
+
+    def submit(self, key, fn, replace=True):
+        """Queue `fn` to run on a worker, returns the future of its result"""
+        future = Future()
+        if key is None:
+            key = object()
+        job = object()
+        with self._cond:
+            stale = self._replaceable.pop(key, None)
+            if stale is not None:
+                self._pending.pop(stale)[1].cancel()
+            while len(self._pending) >= self.max_pending:
+                self._cond.wait()
+            self._pending[job] = (key, future, fn)
+            if replace:
+                self._replaceable[key] = job
+            self._cond.notify_all()
+        return future
+
+    def _next_job(self):
+        """Oldest pending job whose key is not running, call with the lock"""
+        for job, (key, future, fn) in self._pending.items():
+            if key not in self._running:
+                del self._pending[job]
+                if self._replaceable.get(key) is job:
+                    del self._replaceable[key]
+                return key, (future, fn)
+        return None
+
+    def _work(self):
+        self._local.is_worker = True
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                key, (future, fn) = job
+                self._running.add(key)
+                self._cond.notify_all()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn())
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running.discard(key)
+                    self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait for the queued and running jobs to be done, returns whether they
+        are all done within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._running:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+        return True
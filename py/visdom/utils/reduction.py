@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Copyright 2017-present, The Visdom Authors
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Dimensionality reductions of the embeddings feature written with NumPy only,
+for layouts of large feature sets in seconds and without native builds.
+"""
+
+import numpy as np
+
+NUM_LANDMARKS = 2000
+NUM_NEIGHBORS = 5  # landmarks placing each of the other points
+CHUNK_SIZE = 1024  # rows of the features read and converted at once
+
+
+def _chunks(X):
+    """Rows of X by chunks, as float32, so a memmap is never loaded whole"""
+    for start in range(0, len(X), CHUNK_SIZE):
+        yield start, np.asarray(X[start : start + CHUNK_SIZE], dtype=np.float32)
+
+
+def normalize(Y):
+    """Scale 2d positions to [-1, 1] on both axes, as a list of pairs"""
+    Y = np.asarray(Y, dtype=np.float64)
+    low, high = Y.min(axis=0), Y.max(axis=0)
+    span = np.where(high > low, high - low, 1)
+    Y = (Y - low) / span * 2 - 1
+    return list(zip(Y[:, 0].tolist(), Y[:, 1].tolist()))
+
+
+def randomized_pca(X, num_components=2, oversamples=10, num_iter=4, seed=0):
+    """
+    Project X on its first principal components, found with the randomized
+    SVD of Halko et al. (2011) in a few passes over the data. X is read by
+    chunks of rows.
+    """
+    if not isinstance(X, np.ndarray):
+        X = np.asarray(X, dtype=np.float32)
+    num_points, num_features = X.shape
+    mean = np.zeros(num_features)
+    for _, chunk in _chunks(X):
+        mean += chunk.sum(axis=0, dtype=np.float64)
+    mean = (mean / num_points).astype(np.float32)
+
+    def times(M):
+        """(X - mean) @ M"""
+        out = np.empty((num_points, M.shape[1]), dtype=np.float32)
+        for start, chunk in _chunks(X):
+            out[start : start + len(chunk)] = (chunk - mean) @ M
+        return out
+
+    def transpose_times(M):
+        """(X - mean).T @ M"""
+        out = np.zeros((num_features, M.shape[1]), dtype=np.float32)
+        for start, chunk in _chunks(X):
+            out += (chunk - mean).T @ M[start : start + len(chunk)]
+        return out
+
+    rank = min(num_components + oversamples, num_points, num_features)
+    rng = np.random.RandomState(seed)
+    Q = times(rng.standard_normal((num_features, rank)).astype(np.float32))
+    # power iterations, orthonormalized for stability
+    for _ in range(num_iter):
+        Q, _ = np.linalg.qr(Q)
+        Q, _ = np.linalg.qr(transpose_times(Q))
+        Q = times(Q)
+    Q, _ = np.linalg.qr(Q)
+    U, S, _ = np.linalg.svd(transpose_times(Q).T, full_matrices=False)
+    Y = Q @ (U[:, :num_components] * S[:num_components])
+    if Y.shape[1] < num_components:  # fewer features than components
+        Y = np.pad(Y, ((0, 0), (0, num_components - Y.shape[1])))
+    return Y
+
+
+def landmark_projection(X, reduce, num_landmarks=NUM_LANDMARKS, seed=0):
+    """
+    Lay out a random subsample of landmarks of X with `reduce`, then place
+    each other point at the average position of its nearest landmarks,
+    weighted by their inverse distances. X is read by chunks of rows.
+    """
+    if not isinstance(X, np.ndarray):
+        X = np.asarray(X, dtype=np.float32)
+    num_points = len(X)
+    if num_points <= num_landmarks:
+        return np.asarray(reduce(np.asarray(X, dtype=np.float32)), dtype=np.float64)
+    rng = np.random.RandomState(seed)
+    # sorted, for a memmap to read the landmarks in order
+    landmarks = np.sort(rng.choice(num_points, num_landmarks, replace=False))
+    L = np.asarray(X[landmarks], dtype=np.float32)
+    landmark_Y = np.asarray(reduce(L), dtype=np.float64)
+
+    L_norms = (L**2).sum(axis=1)
+    Y = np.empty((num_points, landmark_Y.shape[1]))
+    for start, chunk in _chunks(X):
+        # squared distances to the landmarks, computed in place
+        dists = chunk @ L.T
+        dists *= -2
+        dists += L_norms
+        dists += (chunk**2).sum(axis=1)[:, None]
+        nearest = np.argpartition(dists, NUM_NEIGHBORS, axis=1)[:, :NUM_NEIGHBORS]
+        nearest_dists = np.take_along_axis(dists, nearest, axis=1)
+        weights = 1 / (np.sqrt(np.maximum(nearest_dists, 0)) + 1e-12)
+        weights /= weights.sum(axis=1, keepdims=True)
+        Y[start : start + len(chunk)] = np.einsum(
+            "ij,ijk->ik", weights, landmark_Y[nearest]
+        )
+    Y[landmarks] = landmark_Y
+    return Y
@@ -20,7 +20,9 @@ import hashlib
 import json
 import logging
 import os
+import re
 import time
+import jsonpatch
 import tornado.escape
 from collections import OrderedDict
 
@@ -32,12 +34,21 @@ except ImportError:
     from collections import Mapping, Sequence
 from visdom.server.defaults import (
     LAYOUT_FILE,
+    SNAPSHOT_DIR,
+    SNAPSHOT_GRACE_PERIOD,
     DEFAULT_BASE_URL,
     DEFAULT_ENV_PATH,
     DEFAULT_HOSTNAME,
     DEFAULT_PORT,
+    PREVIEW_CACHE_SIZE,
+)
+from visdom.server.metrics import METRICS
+from visdom.utils.shared_utils import (
+    ensure_dir_exists,
+    get_new_window_id,
+    get_rand_id,
+    warn_once,
 )
-from visdom.utils.shared_utils import warn_once, get_rand_id, get_new_window_id
 
 
 # ---- Vaguely server-security related functions ---- #
@@ -55,7 +66,7 @@ def check_auth(f):
         if handler.login_enabled and not handler.current_user:
             handler.set_status(400)
             return
-        f(handler, *args, **kwargs)
+        return f(handler, *args, **kwargs)
 
     return _check_auth
 
@@ -88,8 +99,7 @@ class LazyEnvData(Mapping):
             return
 
         try:
-            with open(self._env_path_file, "r") as fn:
-                env_data = tornado.escape.json_decode(fn.read())
+            env_data = read_env_file(self._env_path_file)
         except Exception as e:
             raise ValueError(
                 "Failed loading environment json: {} - {}".format(
@@ -115,16 +125,268 @@ class LazyEnvData(Mapping):
         return len(self._raw_dict)
 
 
+class EnvWindows(dict):
+    """
+    Windows of an env that was forked, or that is the parent of a fork.
+
+    Forks share their window objects with their parent until either env
+    modifies them, so windows in `shared` have to be copied before being
+    changed in place, see `own_window`. A fork is saved to disk as a
+    reference to a snapshot of its parent, plus the windows that differ
+    from that snapshot.
+    """
+
+    def __init__(
+        self, windows=(), shared=(), snapshot=None, snapshot_wids=None, unchanged=None
+    ):
+        super().__init__(windows)
+        self.shared = set(shared)
+        # snapshot file that this env's windows are based on, the ids of its
+        # windows, and of those this env still has unchanged
+        self.snapshot = snapshot
+        self.snapshot_wids = set(
+            self.keys() if snapshot_wids is None else snapshot_wids
+        )
+        self.unchanged = set(self.snapshot_wids if unchanged is None else unchanged)
+        # snapshot file holding exactly the current windows, if any, to be
+        # reused by further forks
+        self.current_snapshot = None
+        if snapshot is not None and self.unchanged == set(self.keys()):
+            self.current_snapshot = snapshot
+
+    def modified(self, wid):
+        self.shared.discard(wid)
+        self.unchanged.discard(wid)
+        self.current_snapshot = None
+
+    def __setitem__(self, wid, window):
+        self.modified(wid)
+        super().__setitem__(wid, window)
+
+    def __delitem__(self, wid):
+        self.modified(wid)
+        super().__delitem__(wid)
+
+    def pop(self, wid, *args):
+        self.modified(wid)
+        return super().pop(wid, *args)
+
+    def delta(self):
+        """The windows and deletions of the env relative to its snapshot"""
+        return {
+            "parent": self.snapshot,
+            "jsons": {wid: w for wid, w in self.items() if wid not in self.unchanged},
+            "deleted": sorted(self.snapshot_wids - set(self.keys())),
+        }
+
+
+class PreviewCache:
+    """
+    Hover previews of the entities of embeddings windows, as sent by the
+    python client, so that the next hovers of an entity are answered without
+    asking the client again. The least recently used previews are dropped.
+
+    Previews are keyed by the `previews_id` of their window, which is new for
+    each embeddings drawn, and by the index of their entity.
+    """
+
+    def __init__(self, size=PREVIEW_CACHE_SIZE):
+        self.size = size
+        self._previews = OrderedDict()
+
+    def get(self, p, idx):
+        key = (p.get("previews_id"), str(idx))
+        preview = self._previews.get(key)
+        if preview is not None:
+            self._previews.move_to_end(key)
+        return preview
+
+    def put(self, p, idx, preview):
+        if p.get("previews_id") is None:
+            return  # saved before the previews were cached
+        self._previews[(p["previews_id"], str(idx))] = preview
+        self._previews.move_to_end((p["previews_id"], str(idx)))
+        while len(self._previews) > self.size:
+            self._previews.popitem(last=False)
+
+
+def push_embeddings_layer(p):
+    """
+    Push the points shown by an embeddings window on its stack of previous
+    layers, before it shows those of a selected region. A layer is stored as
+    the indices and positions of its points: the other fields of the points
+    are kept once, in the `entities` of the window.
+    """
+    points = p["content"]["data"]
+    if "entities" not in p:
+        p["entities"] = points  # the first layer, showing all the entities
+    p["old_content"].append(
+        {
+            "idxs": [point["idx"] for point in points],
+            "positions": [point["position"] for point in points],
+        }
+    )
+    undo_depth = p.get("undo_depth")
+    if undo_depth is not None and len(p["old_content"]) > undo_depth:
+        del p["old_content"][: len(p["old_content"]) - undo_depth]
+
+
+def pop_embeddings_layer(p):
+    """Points of the previous layer of an embeddings window"""
+    layer = p["old_content"].pop()
+    if isinstance(layer, list):
+        return layer  # stored whole by older versions
+    entities = {point["idx"]: point for point in p["entities"]}
+    return [
+        dict(entities[idx], position=position)
+        for idx, position in zip(layer["idxs"], layer["positions"])
+    ]
+
+
+def own_window(env, wid):
+    """
+    Return a window of an env for modifying it in place, copying it first
+    if it is shared with a fork.
+    """
+    jsons = env["jsons"]
+    if isinstance(jsons, EnvWindows):
+        if wid in jsons.shared:
+            jsons[wid] = copy.deepcopy(jsons[wid])
+        else:
+            jsons.modified(wid)
+    return jsons[wid]
+
+
+def fork_env(state, prev_eid, eid, env_path=DEFAULT_ENV_PATH):
+    """
+    Fork an env without copying its windows, and save the fork as a delta
+    to a snapshot of the parent. Saving an env onto itself is not a fork.
+    """
+    if prev_eid == eid:
+        return state[eid]
+    parent = state[prev_eid]
+    jsons = parent["jsons"]
+    if not isinstance(jsons, EnvWindows):
+        jsons = EnvWindows(jsons)
+        parent["jsons"] = jsons
+    jsons.shared.update(jsons.keys())
+
+    snapshot = jsons.current_snapshot
+    if snapshot is not None and env_path is not None:
+        try:
+            # keep it from being collected until the fork is saved
+            os.utime(os.path.join(env_path, SNAPSHOT_DIR, snapshot))
+        except OSError:
+            snapshot = None  # collected since the last fork
+    if snapshot is None and env_path is not None:
+        # the first fork of this version of the parent writes it once
+        snapshot = "{}.{}.json".format(prev_eid, get_rand_id())
+        snapshot_dir = os.path.join(env_path, SNAPSHOT_DIR)
+        ensure_dir_exists(snapshot_dir)
+        with open(os.path.join(snapshot_dir, snapshot), "w") as fn:
+            fn.write(json.dumps({"jsons": jsons}))
+        jsons.current_snapshot = snapshot
+
+    state[eid] = {
+        "jsons": EnvWindows(jsons, shared=jsons.keys(), snapshot=snapshot),
+        "reload": copy.deepcopy(parent["reload"]),
+    }
+    return state[eid]
+
+
+def read_env_file(env_path_file):
+    """Read a saved env, resolving forks against the snapshot of their parent"""
+    with open(env_path_file, "r") as fn:
+        env_data = tornado.escape.json_decode(fn.read())
+    jsons = env_data["jsons"]
+    if env_data.get("parent") is not None:
+        snapshot_file = os.path.join(
+            os.path.dirname(env_path_file), SNAPSHOT_DIR, env_data["parent"]
+        )
+        with open(snapshot_file, "r") as fn:
+            windows = tornado.escape.json_decode(fn.read())["jsons"]
+        snapshot_wids = set(windows.keys())
+        for wid in env_data["deleted"]:
+            windows.pop(wid, None)
+        unchanged = set(windows.keys()) - set(jsons.keys())
+        windows.update(jsons)
+        jsons = EnvWindows(
+            windows,
+            snapshot=env_data["parent"],
+            snapshot_wids=snapshot_wids,
+            unchanged=unchanged,
+        )
+    return {"jsons": jsons, "reload": env_data["reload"]}
+
+
+PARENT_PREFIX = re.compile(r'\{"parent": (null|"(?:[^"\\]|\\.)*")')
+
+
+def read_env_parent(env_path_file):
+    """
+    Name of the snapshot a saved env is a fork of, if any. Forks are saved
+    with their parent first, so only the start of the file is read.
+    """
+    with open(env_path_file, "r") as fn:
+        start = fn.read(4096)
+    if not start.startswith('{"parent": '):
+        return None
+    match = PARENT_PREFIX.match(start)
+    if match is None:  # longer than what was read
+        with open(env_path_file, "r") as fn:
+            return tornado.escape.json_decode(fn.read()).get("parent")
+    return json.loads(match.group(1))
+
+
+def collect_snapshots(env_path=DEFAULT_ENV_PATH):
+    """
+    Remove the snapshots that no saved env is a fork of anymore. Recent
+    snapshots are kept, as another server process may be saving their fork.
+    """
+    if env_path is None:
+        return
+    snapshot_dir = os.path.join(env_path, SNAPSHOT_DIR)
+    if not os.path.isdir(snapshot_dir):
+        return
+    parents = set()
+    for env_json in os.listdir(env_path):
+        env_path_file = os.path.join(env_path, env_json)
+        if ".json" not in env_json or not os.path.isfile(env_path_file):
+            continue
+        try:
+            parents.add(read_env_parent(env_path_file))
+        except (OSError, ValueError):
+            logging.warn("Failed reading the parent of {}".format(env_path_file))
+            return  # it may be the fork of any snapshot
+    now = time.time()
+    for snapshot in os.listdir(snapshot_dir):
+        snapshot_file = os.path.join(snapshot_dir, snapshot)
+        try:
+            if (
+                snapshot not in parents
+                and now - os.path.getmtime(snapshot_file) > SNAPSHOT_GRACE_PERIOD
+            ):
+                os.remove(snapshot_file)
+        except OSError:
+            pass  # removed by another server process
+
+
 def serialize_env(state, eids, env_path=DEFAULT_ENV_PATH):
     env_ids = [i for i in eids if i in state]
     if env_path is not None:
+        start = time.time()
         for env_id in env_ids:
             env_path_file = os.path.join(env_path, "{0}.json".format(env_id))
+            env = state[env_id]
+            if isinstance(env, LazyEnvData):
+                env = env._raw_dict
+            if env is not None and isinstance(env["jsons"], EnvWindows):
+                if env["jsons"].snapshot is not None:
+                    # the parent comes first, see read_env_parent
+                    env = dict(env["jsons"].delta(), reload=env["reload"])
             with open(env_path_file, "w") as fn:
-                if isinstance(state[env_id], LazyEnvData):
-                    fn.write(json.dumps(state[env_id]._raw_dict))
-                else:
-                    fn.write(json.dumps(state[env_id]))
+                fn.write(json.dumps(env))
+        METRICS.serialize_seconds.observe(time.time() - start)
     return env_ids
 
 
@@ -197,6 +459,7 @@ def window(args):
                 "selected": 0,
                 "type": ptype,
                 "show_slider": opts.get("show_slider", True),
+                "history_size": opts.get("history_size"),
             }
         )
     elif ptype in ["image", "text", "properties"]:
@@ -217,6 +480,8 @@ def window(args):
                 "content": args["data"][0]["content"],
                 "type": ptype,
                 "old_content": [],  # Used to cache previous to prevent recompute
+                "undo_depth": opts.get("undo_depth"),
+                "previews_id": get_rand_id(),  # key of its hover previews
             }
         )
         p["content"]["has_previous"] = False
@@ -235,142 +500,319 @@ def gather_envs(state, env_path=DEFAULT_ENV_PATH):
     return sorted(list(set(items + list(state.keys()))))
 
 
-def compare_envs(state, eids, socket, env_path=DEFAULT_ENV_PATH):
-    logging.info("comparing envs")
-    eidNums = {e: str(i) for i, e in enumerate(eids)}
-    env = {}
-    envs = {}
-    for eid in eids:
-        if eid in state:
-            envs[eid] = state.get(eid)
-        elif env_path is not None:
-            p = os.path.join(env_path, eid.strip(), ".json")
-            if os.path.exists(p):
-                with open(p, "r") as fn:
-                    env = tornado.escape.json_decode(fn.read())
-                    state[eid] = env
-                    envs[eid] = env
-
-    res = copy.deepcopy(envs[list(envs.keys())[0]])
-    name2Wid = {
-        res["jsons"][wid].get("title", None): wid + "_compare"
-        for wid in res.get("jsons", {})
-        if "title" in res["jsons"][wid]
-    }
-    for wid in list(res["jsons"].keys()):
-        res["jsons"][wid + "_compare"] = res["jsons"][wid]
-        res["jsons"][wid] = None
-        res["jsons"].pop(wid)
-
-    for ix, eid in enumerate(sorted(envs.keys())):
-        env = envs[eid]
-        for wid in env.get("jsons", {}).keys():
-            win = env["jsons"][wid]
-            if win.get("type", None) != "plot":
+def apply_broadcast(state, msg, eid):
+    """Apply a window broadcast to a replica of the env it was sent for"""
+    if isinstance(msg, str):
+        msg = json.loads(msg)
+    command = msg.get("command")
+    if eid not in state:
+        state[eid] = {"jsons": {}, "reload": {}}
+    jsons = state[eid]["jsons"]
+    if command == "window":
+        jsons[msg["id"]] = msg
+    elif command == "window_update":
+        if msg["win"] in jsons:
+            window = own_window(state[eid], msg["win"])
+            jsonpatch.apply_patch(window, msg["content"], in_place=True)
+    elif command == "close":
+        jsons.pop(msg["data"], None)
+
+
+class CompareView:
+    """
+    Merged view of the plots that several envs share a window title for.
+
+    Windows of the first of the envs define the merged windows, and each
+    merged window holds the traces of every env with a plot of that title.
+    The view is built once and shared by all sockets comparing the same
+    envs. Broadcasts for any of the envs are applied to it incrementally,
+    appends being forwarded as patches on the merged traces.
+    """
+
+    def __init__(self, state, eids, replica=False):
+        self.state = state
+        self.eids = eids
+        self.key = tuple(eids)
+        # envs are numbered in the selected order, and traces prefixed with
+        # these numbers to make the plot lines more readable
+        self.eid_nums = {e: str(i) for i, e in enumerate(eids)}
+        # a replica view holds its own copies of the envs, e.g. on a router
+        self.replica = replica
+        self.members = [eid for eid in eids if eid in state]
+        self.titles = {eid: self.index_env(eid) for eid in self.members}
+        self.windows = {}  # merged window by title
+        self.slices = {}  # title -> eid -> (first trace, number of traces)
+        base = self.state[self.members[0]]
+        self.reload = copy.deepcopy(base["reload"])
+        for title in self.titles[self.members[0]]:
+            self.merge(title)
+
+    def index_env(self, eid):
+        """Map the titles of the plots of an env to their window ids"""
+        index = {}
+        for wid, win in self.state[eid]["jsons"].items():
+            if win.get("type", None) != "plot" or "content" not in win:
                 continue
-            if "content" not in win:
+            if win.get("title", "") == "":
                 continue
-            if "title" not in win:
+            index[win["title"]] = wid
+        return index
+
+    def title_of(self, eid, wid):
+        for title, title_wid in self.titles.get(eid, {}).items():
+            if title_wid == wid:
+                return title
+        return None
+
+    def merge(self, title):
+        """(Re)build the merged window for a title, returns it or None"""
+        self.windows.pop(title, None)
+        self.slices.pop(title, None)
+        base_wid = self.titles[self.members[0]].get(title)
+        if base_wid is None:
+            return None
+        # Only combine envs whose traces are all labeled
+        parts = []
+        for eid in sorted(self.members):
+            wid = self.titles[eid].get(title)
+            if wid is None:
                 continue
-            title = win["title"]
-            if title not in name2Wid or title == "":
+            data = self.state[eid]["jsons"][wid]["content"]["data"]
+            if len(data) > 0 and all("name" in trace for trace in data):
+                parts.append((eid, data))
+        # Only plots that are shared by at least two envs are shown
+        if len(parts) < 2:
+            return None
+
+        base_win = self.state[self.members[0]]["jsons"][base_wid]
+        merged = copy.deepcopy({k: v for k, v in base_win.items() if k != "content"})
+        merged["content"] = copy.deepcopy(
+            {k: v for k, v in base_win["content"].items() if k != "data"}
+        )
+        merged["id"] = base_wid + "_compare"
+        merged["has_compare"] = True
+        merged["contentID"] = get_rand_id()
+        merged["content"]["layout"]["showlegend"] = True
+        merged["content"]["data"] = []
+        slices = {}
+        for eid, data in parts:
+            slices[eid] = (len(merged["content"]["data"]), len(data))
+            for trace in data:
+                trace = copy.deepcopy(trace)
+                trace["name"] = "{}_{}".format(self.eid_nums[eid], trace["name"])
+                merged["content"]["data"].append(trace)
+        self.windows[title] = merged
+        self.slices[title] = slices
+        return merged
+
+    def translate_patch(self, eid, title, patch):
+        """
+        Translate a patch of a window of one of the envs to the merged
+        window, or return None if the merged window has to be rebuilt.
+        """
+        if eid not in self.slices[title]:
+            return None
+        first, count = self.slices[title][eid]
+        merged_patch = []
+        for op in patch:
+            path = op["path"].split("/")
+            if op["path"] in ["/contentID", "/version"]:
                 continue
+            if "from" in op:
+                return None
+            if path[1:3] == ["content", "data"]:
+                # only changes within the existing traces can be translated
+                if len(path) < 5 or path[4] == "name" or not path[3].isdigit():
+                    return None
+                if int(path[3]) >= count:
+                    return None
+                path[3] = str(first + int(path[3]))
+                merged_patch.append(dict(op, path="/".join(path)))
+            elif eid == self.members[0]:
+                return None  # changes the opts or layout of the merged window
+        return merged_patch
+
+    def update(self, msg, eid):
+        """Apply a broadcast for one of the envs, returns the messages to send"""
+        if self.replica:
+            apply_broadcast(self.state, msg, eid)
+        if isinstance(msg, str):
+            msg = json.loads(msg)
+        if eid not in self.titles or eid not in self.state:
+            return []
+        command = msg.get("command")
+        if command == "window_update":
+            wid = msg["win"]
+        elif command == "window":
+            wid = msg["id"]
+        elif command == "close":
+            wid = msg["data"]
+        else:
+            return []
 
-            destWid = name2Wid[title]
-            destWidJson = res["jsons"][destWid]
-            # Combine plots with the same window title. If plot data source was
-            # labeled "name" in the legend, rename to "envId_legend" where
-            # envId is enumeration of the selected environments (not the long
-            # environment id string). This makes plot lines more readable.
-            if ix == 0:
-                if "name" not in destWidJson["content"]["data"][0]:
-                    continue  # Skip windows with unnamed data
-                destWidJson["has_compare"] = False
-                destWidJson["content"]["layout"]["showlegend"] = True
-                destWidJson["contentID"] = get_rand_id()
-                for dataIdx, data in enumerate(destWidJson["content"]["data"]):
-                    if "name" not in data:
-                        break  # stop working with this plot, not right format
-                    destWidJson["content"]["data"][dataIdx]["name"] = "{}_{}".format(
-                        eidNums[eid], data["name"]
+        old_title = self.title_of(eid, wid)
+        retitled = command == "window_update" and any(
+            op["path"] == "/title" for op in msg["content"]
+        )
+        if command != "window_update" or old_title is None or retitled:
+            self.titles[eid] = self.index_env(eid)
+        new_title = self.title_of(eid, wid)
+
+        messages = []
+        for title in {old_title, new_title} - {None}:
+            merged = self.windows.get(title)
+            if command == "window_update" and old_title == new_title and merged:
+                patch = self.translate_patch(eid, title, msg["content"])
+                if patch is not None:
+                    patch += [
+                        {"op": "replace", "path": "/contentID", "value": get_rand_id()},
+                        {
+                            "op": "replace",
+                            "path": "/version",
+                            "value": merged["version"] + 1,
+                        },
+                    ]
+                    jsonpatch.apply_patch(merged, patch, in_place=True)
+                    messages.append(
+                        {
+                            "command": "window_update",
+                            "win": merged["id"],
+                            "content": patch,
+                            "version": merged["version"],
+                            "has_compare": True,
+                        }
                     )
-            else:
-                if "name" not in destWidJson["content"]["data"][0]:
-                    continue  # Skip windows with unnamed data
-                # has_compare will be set to True only if the window title is
-                # shared by at least 2 envs.
-                destWidJson["has_compare"] = True
-                for _dataIdx, data in enumerate(win["content"]["data"]):
-                    data = copy.deepcopy(data)
-                    if "name" not in data:
-                        destWidJson["has_compare"] = False
-                        break  # stop working with this plot, not right format
-                    data["name"] = "{}_{}".format(eidNums[eid], data["name"])
-                    destWidJson["content"]["data"].append(data)
-
-    # Make sure that only plots that are shared by at least two envs are shown.
-    # Check has_compare flag
-    for destWid in list(res["jsons"].keys()):
-        if ("has_compare" not in res["jsons"][destWid]) or (
-            not res["jsons"][destWid]["has_compare"]
-        ):
-            del res["jsons"][destWid]
-
-    # create legend mapping environment names to environment numbers so one can
-    # look it up for the new legend
-    tableRows = [
-        "<tr> <td> {} </td> <td> {} </td> </tr>".format(v, eidNums[v]) for v in eidNums
-    ]
+                    continue
+            if title not in self.titles[self.members[0]] and merged is None:
+                continue
+            version = merged["version"] if merged is not None else 0
+            new_merged = self.merge(title)
+            if new_merged is not None:
+                new_merged["version"] = version + 1
+                messages.append(new_merged)
+            elif merged is not None:
+                messages.append({"command": "close", "data": merged["id"]})
+        return messages
+
+    def legend(self):
+        # create legend mapping environment names to environment numbers so
+        # one can look it up for the new legend
+        tableRows = [
+            "<tr> <td> {} </td> <td> {} </td> </tr>".format(v, self.eid_nums[v])
+            for v in self.eid_nums
+        ]
+
+        tbl = """"<style>
+        table, th, td {{
+            border: 1px solid black;
+        }}
+        </style>
+        <table> {} </table>""".format(
+            " ".join(tableRows)
+        )
 
-    tbl = """"<style>
-    table, th, td {{
-        border: 1px solid black;
-    }}
-    </style>
-    <table> {} </table>""".format(
-        " ".join(tableRows)
-    )
+        return {
+            "command": "window",
+            "version": 1,
+            "id": "window_compare_legend",
+            "title": "compare_legend",
+            "inflate": True,
+            "width": None,
+            "height": None,
+            "contentID": "compare_legend",
+            "content": tbl,
+            "type": "text",
+            "layout": {"title": "compare_legend"},
+            "i": 1,
+            "has_compare": True,
+        }
+
+    def send(self, socket):
+        """Load the view to a client by socket"""
+        socket.write_message(json.dumps({"command": "reload", "data": self.reload}))
+
+        jsons = list(self.windows.values()) + [self.legend()]
+        windows = sorted(jsons, key=lambda k: ("i" not in k, k.get("i", None)))
+        for v in windows:
+            socket.write_message(v)
+
+        socket.write_message(json.dumps({"command": "layout"}))
+        socket.eid = self.eids
+        socket.compare_view = self
+
+
+def compare_envs(state, eids, socket, env_path=DEFAULT_ENV_PATH, replica=False):
+    logging.info("comparing envs")
+    for eid in eids:
+        if eid not in state and env_path is not None:
+            p = os.path.join(env_path, eid.strip(), ".json")
+            if os.path.exists(p):
+                with open(p, "r") as fn:
+                    state[eid] = tornado.escape.json_decode(fn.read())
+
+    # share the view with the other sockets comparing the same envs
+    view = None
+    subs = getattr(socket, "subs", {})
+    for sub in subs.values():
+        sub_view = getattr(sub, "compare_view", None)
+        if isinstance(sub.eid, list) and sub_view is not None:
+            if sub_view.key == tuple(eids):
+                view = sub_view
+                break
+    if view is None:
+        view = CompareView(state, eids, replica=replica)
+    view.send(socket)
 
-    res["jsons"]["window_compare_legend"] = {
-        "command": "window",
-        "version": 1,
-        "id": "window_compare_legend",
-        "title": "compare_legend",
-        "inflate": True,
-        "width": None,
-        "height": None,
-        "contentID": "compare_legend",
-        "content": tbl,
-        "type": "text",
-        "layout": {"title": "compare_legend"},
-        "i": 1,
-        "has_compare": True,
-    }
-    if "reload" in res:
-        socket.write_message(json.dumps({"command": "reload", "data": res["reload"]}))
 
-    jsons = list(res.get("jsons", {}).values())
-    windows = sorted(jsons, key=lambda k: ("i" not in k, k.get("i", None)))
-    for v in windows:
-        socket.write_message(v)
+# ------- Broadcasting functions ---------- #
 
-    socket.write_message(json.dumps({"command": "layout"}))
-    socket.eid = eids
 
+def get_bus(handler):
+    """Return the worker bus if the server runs as several processes"""
+    app = getattr(handler, "app", None) or getattr(handler, "application", None)
+    return getattr(app, "bus", None)
 
-# ------- Broadcasting functions ---------- #
+
+def get_relays(handler):
+    """
+    Return the channels that changes are published on: the worker bus, and
+    the change stream followed by read-only follower servers.
+    """
+    app = getattr(handler, "app", None) or getattr(handler, "application", None)
+    relays = [getattr(app, "bus", None), getattr(app, "change_stream", None)]
+    return [relay for relay in relays if relay is not None]
 
 
-def broadcast_envs(handler, target_subs=None):
+def relay_to_workers(handler, kind, **payload):
+    """Publish a message to the other worker processes and to followers"""
+    for relay in get_relays(handler):
+        relay.publish(kind, **payload)
+
+
+def relay_env(handler, eid, create_only=False):
+    """Replicate the current contents of an env to the other workers"""
+    if not get_relays(handler):
+        return
+    env = handler.state.get(eid)
+    if env is not None:
+        env = {"jsons": env["jsons"], "reload": env["reload"]}
+    relay_to_workers(handler, "env", eid=eid, env=env, create_only=create_only)
+
+
+def broadcast_envs(handler, target_subs=None, relay=True):
     if target_subs is None:
         target_subs = handler.subs.values()
+        if relay:
+            relay_to_workers(handler, "broadcast_envs")
     for sub in target_subs:
         sub.write_message(
             json.dumps({"command": "env_update", "data": list(handler.state.keys())})
         )
 
 
-def send_to_sources(handler, msg):
+def send_to_sources(handler, msg, relay=True):
+    if relay:
+        relay_to_workers(handler, "sources", msg=msg)
     target_sources = handler.sources.values()
     for source in target_sources:
         source.write_message(json.dumps(msg))
@@ -400,14 +842,35 @@ def load_env(state, eid, socket, env_path=DEFAULT_ENV_PATH):
     socket.eid = eid
 
 
-def broadcast(self, msg, eid):
+def broadcast(self, msg, eid, relay=True):
+    if relay:
+        relay_to_workers(self, "broadcast", msg=msg, eid=eid)
+    view_messages = {}
+    encoded = None  # the message is serialized once for all the sockets
+    num_messages = num_bytes = 0
     for s in self.subs:
-        if isinstance(self.subs[s].eid, dict):
-            if eid in self.subs[s].eid:
-                self.subs[s].write_message(msg)
+        if isinstance(self.subs[s].eid, list):
+            # sockets comparing envs get the updates of their compare view
+            view = getattr(self.subs[s], "compare_view", None)
+            if view is None or eid not in view.eids:
+                continue
+            if view not in view_messages:
+                view_messages[view] = [
+                    m if isinstance(m, str) else json.dumps(m)
+                    for m in view.update(msg, eid)
+                ]
+            for view_msg in view_messages[view]:
+                self.subs[s].write_message(view_msg)
+                num_messages += 1
+                num_bytes += len(view_msg)
         else:
             if self.subs[s].eid == eid:
-                self.subs[s].write_message(msg)
+                if encoded is None:
+                    encoded = msg if isinstance(msg, str) else json.dumps(msg)
+                self.subs[s].write_message(encoded)
+                num_messages += 1
+                num_bytes += len(encoded)
+    METRICS.observe_broadcast(num_messages, num_bytes)
 
 
 def register_window(self, p, eid):